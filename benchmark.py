@@ -0,0 +1,741 @@
+#!/usr/bin/env python
+
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Benchmark alternative builds of the DSP classes against the default build.
+
+Run `python build-all.py dsp/` first, such that the headers exist.
+"""
+
+import json
+from pathlib import Path
+from typing import Iterable, Mapping, Tuple
+
+import numpy as np
+
+from dspfit import bench, cabinet, primitives, render, tonestack, utils, wrapdsp
+
+CLASS_NAMES = ("Cabinet", "ToneStack", "Triode", "TetrodeGrid", "TetrodePlate")
+SIGNALS = ("data/signal.wav", "data/hi-gain.wav", "data/lo-gain.wav")
+
+
+def measure_build(
+    lib_name: str,
+    path_build: Path,
+    fs: int,
+    signal: np.ndarray,
+    kwargs: Mapping[str, float],
+    reference: Tuple[float, np.ndarray],
+    repeats: int,
+):
+    """
+    Measure the render time of a build and the deviation of its output from
+    a `reference` (seconds, output) tuple, if given.
+
+    Returns:
+        the results and the output
+    """
+    func = wrapdsp.make_callable(lib_name, path_build)
+    values = func.library.pack(**kwargs)
+    output = func(fs, signal, values)[0]
+    seconds = bench.time_call(func, fs, signal, values, repeats=repeats)
+
+    if reference is None:
+        reference = (seconds, output)
+
+    result = {
+        "seconds": seconds,
+        "speedup": reference[0] / seconds,
+        **bench.deviation(reference[1], output),
+    }
+
+    return result, output
+
+
+def print_result(class_name: str, build: str, result: Mapping[str, float]):
+    print(
+        f"{class_name:>12s} {build:>9s} "
+        f"{result['seconds'] * 1e3:8.2f} ms "
+        f"x{result['speedup']:5.2f} "
+        f"max dev {result['max_abs']:.2e} "
+        f"rms dev {result['rel_rms']:.2e}"
+    )
+
+
+def bench_profiles(
+    path_dsp: Path,
+    path_build: Path,
+    path_headers: Path,
+    class_names: Iterable[str],
+    profiles: Iterable[str],
+    repeats: int,
+):
+    """
+    Build each class with each of the compiler `profiles` and measure the
+    render time and output deviation relative to the first profile.
+    """
+    signal, fs = utils.wave_to_numpy(SIGNALS[0])
+
+    results = dict()
+    for class_name in class_names:
+        pars = wrapdsp.run_fausthpp(path_headers, path_dsp, class_name)
+        with (path_headers / f"{class_name}.h").open("r") as fio:
+            code = fio.read()
+        wrapped_code = wrapdsp.wrap_compute(code, class_name, pars)
+        kwargs = wrapdsp.default_values(class_name, pars)
+
+        reference = None
+        results[class_name] = dict()
+        for profile in profiles:
+            lib_name = f"{class_name}-{profile}"
+            if profile == "pgo":
+                wrapdsp.compile_pgo(
+                    class_name,
+                    path_build,
+                    path_headers,
+                    wrapped_code,
+                    train_signals=[Path(p) for p in SIGNALS],
+                    train_values=kwargs,
+                    lib_name=lib_name,
+                )
+            else:
+                wrapdsp.compile_wrapped(
+                    class_name,
+                    path_build,
+                    path_headers,
+                    wrapped_code,
+                    lib_name=lib_name,
+                    profile=profile,
+                )
+
+            result, output = measure_build(
+                lib_name, path_build, fs, signal, kwargs, reference, repeats
+            )
+            if reference is None:
+                reference = (result["seconds"], output)
+            results[class_name][profile] = result
+            print_result(class_name, profile, result)
+
+    return results
+
+
+def bench_codegen(
+    path_dsp: Path,
+    path_build: Path,
+    path_headers: Path,
+    class_names: Iterable[str],
+    modes: Iterable[str],
+    repeats: int,
+    tolerance: float,
+    path_best: Path,
+):
+    """
+    Build each class with each of the faust code generation `modes` and
+    measure the render time and output deviation relative to the first mode.
+
+    The fastest mode whose relative RMS deviation is within `tolerance` is
+    recorded for each class in `path_best`, which `build-all.py` can use with
+    its `--codegen` argument.
+    """
+    signal, fs = utils.wave_to_numpy(SIGNALS[0])
+
+    results = dict()
+    best = dict()
+    for class_name in class_names:
+        # the default header which the modes are spliced into
+        pars = wrapdsp.run_fausthpp(path_headers, path_dsp, class_name)
+        with (path_headers / f"{class_name}.h").open("r") as fio:
+            code = fio.read()
+        wrapped_code = wrapdsp.wrap_compute(code, class_name, pars)
+        kwargs = wrapdsp.default_values(class_name, pars)
+
+        reference = None
+        results[class_name] = dict()
+        for mode in modes:
+            lib_name = f"{class_name}-{mode}"
+            options = wrapdsp.CODEGEN_MODES[mode]
+            faust_code = wrapdsp.faust_codegen(
+                path_headers, path_dsp, class_name, options
+            )
+            path_mode = wrapdsp.codegen_dir(path_build, options)
+            wrapdsp._write_patched(path_mode, path_headers, class_name, faust_code)
+            wrapdsp.compile_wrapped(
+                class_name,
+                path_build,
+                path_headers,
+                wrapped_code,
+                include_dirs=[path_mode],
+                lib_name=lib_name,
+            )
+
+            result, output = measure_build(
+                lib_name, path_build, fs, signal, kwargs, reference, repeats
+            )
+            if reference is None:
+                reference = (result["seconds"], output)
+            results[class_name][mode] = result
+            print_result(class_name, mode, result)
+
+        accepted = [
+            m for m, r in results[class_name].items() if r["rel_rms"] <= tolerance
+        ]
+        mode = min(accepted, key=lambda m: results[class_name][m]["seconds"])
+        best[class_name] = {"mode": mode, "options": wrapdsp.CODEGEN_MODES[mode]}
+        print(f"{class_name:>12s} best mode: {mode}")
+
+    with path_best.open("w") as fio:
+        json.dump(best, fio, indent="\t")
+
+    return results
+
+
+def bench_pch(
+    path_dsp: Path,
+    path_build: Path,
+    path_headers: Path,
+    class_names: Iterable[str],
+    profile: str,
+):
+    """
+    Measure the compilation time of each class without and with the
+    precompiled common headers.
+    """
+    results = dict()
+    for class_name in class_names:
+        pars = wrapdsp.run_fausthpp(path_headers, path_dsp, class_name)
+        with (path_headers / f"{class_name}.h").open("r") as fio:
+            code = fio.read()
+        wrapped_code = wrapdsp.wrap_compute(code, class_name, pars)
+
+        results[class_name] = dict()
+        for pch in (False, True):
+            if pch:
+                # precompile outside of the measurement, it is done once
+                flags = wrapdsp.BUILD_PROFILES[profile]
+                wrapdsp.precompile_headers(path_build, path_headers, flags)
+            seconds = wrapdsp.compile_wrapped(
+                class_name,
+                path_build,
+                path_headers,
+                wrapped_code,
+                lib_name=f"{class_name}-{'pch' if pch else 'nopch'}",
+                profile=profile,
+                pch=pch,
+            )
+            results[class_name]["pch" if pch else "nopch"] = seconds
+
+        print(
+            f"{class_name:>12s} "
+            f"without pch {results[class_name]['nopch']:6.2f} s "
+            f"with pch {results[class_name]['pch']:6.2f} s"
+        )
+
+    return results
+
+
+def bench_cabinet(
+    path_dsp: Path,
+    path_build: Path,
+    path_headers: Path,
+    num_candidates: int,
+    repeats: int,
+):
+    """
+    Verify the analytic `Cabinet` response against the compiled class, at
+    the defaults and at random offsets of the EQ parameters, and compare the
+    time to evaluate `num_candidates` responses with that of rendering one.
+    """
+    pars = wrapdsp.run_fausthpp(path_headers, path_dsp, "Cabinet")
+    with (path_headers / "Cabinet.h").open("r") as fio:
+        code = fio.read()
+    wrapped_code = wrapdsp.wrap_compute(code, "Cabinet", pars)
+    wrapdsp.compile_wrapped("Cabinet", path_build, path_headers, wrapped_code)
+    func = wrapdsp.make_callable("Cabinet", path_build)
+
+    fs = int(48e3)
+    rng = np.random.default_rng(0)
+    eq_pars = [p for p in pars if p.endswith("_l") or p in ("brightness", "distance")]
+
+    results = {"deviation_db": list()}
+    for trial in range(4):
+        offsets = dict()
+        if trial > 0:
+            offsets = {
+                p: float(v) for p, v in zip(eq_pars, rng.normal(size=len(eq_pars)))
+            }
+        deviation = cabinet.verify_compiled(func, fs, path_dsp, offsets)
+        results["deviation_db"].append(deviation)
+        print(f"{'Cabinet':>12s} trial {trial} max deviation {deviation:.2e} dB")
+
+    length = 1 << 16
+    impulse = np.zeros(length, dtype="float32")
+    impulse[0] = 1
+    render = bench.time_call(
+        func, fs, impulse, repeats=repeats, **wrapdsp.default_values("Cabinet", pars)
+    )
+
+    freqs = np.fft.rfftfreq(length, 1.0 / fs)[1:-1]
+    offsets = {p: rng.normal(size=num_candidates) for p in eq_pars}
+    values = cabinet.absolute_values(path_dsp, offsets)
+    analytic = bench.time_call(
+        cabinet.cabinet_response, freqs, fs, values, repeats=repeats
+    )
+
+    results["render_seconds"] = render
+    results["analytic_seconds"] = analytic / num_candidates
+    print(
+        f"{'Cabinet':>12s} render {render * 1e3:8.2f} ms "
+        f"analytic {analytic / num_candidates * 1e3:8.2f} ms per candidate"
+    )
+
+    return results
+
+
+def bench_chunks(
+    path_dsp: Path,
+    path_build: Path,
+    path_headers: Path,
+    class_names: Iterable[str],
+    chunk_length: float,
+    overlaps: Iterable[float],
+    num_workers: int,
+):
+    """
+    Render the signals of all `SIGNALS` end to end in concurrent chunks with
+    each of the warm-up `overlaps`, and measure the deviation from and the
+    speedup over a sequential render.
+    """
+    signals = list()
+    for path in SIGNALS:
+        signal, fs = utils.wave_to_numpy(path)
+        signals.append(signal)
+    signal = np.concatenate(signals).astype("float32")
+
+    results = dict()
+    for class_name in class_names:
+        pars = wrapdsp.run_fausthpp(path_headers, path_dsp, class_name)
+        with (path_headers / f"{class_name}.h").open("r") as fio:
+            code = fio.read()
+        wrapped_code = wrapdsp.wrap_compute(code, class_name, pars)
+        wrapdsp.compile_wrapped(class_name, path_build, path_headers, wrapped_code)
+        func = wrapdsp.make_callable(class_name, path_build)
+        kwargs = wrapdsp.default_values(class_name, pars)
+
+        results[class_name] = dict()
+        for overlap in overlaps:
+            result = render.chunked_error(
+                func,
+                fs,
+                signal,
+                chunk_length,
+                overlap,
+                num_workers=num_workers,
+                **kwargs,
+            )
+            result["speedup"] = result["sequential_seconds"] / result["chunked_seconds"]
+            results[class_name][overlap] = result
+            print(
+                f"{class_name:>12s} overlap {overlap:6.3f} s "
+                f"x{result['speedup']:5.2f} "
+                f"max dev {result['max_abs']:.2e} "
+                f"rms dev {result['rel_rms']:.2e}"
+            )
+
+    return results
+
+
+def bench_primitives(
+    path_dsp: Path, path_build: Path, names: Iterable[str], length: int, repeats: int
+):
+    """
+    Build each primitive of `common.dsp` standalone in each of its
+    formulations, and measure the render time per sample and the maximum
+    deviation from its float64 reference. The time net of the `identity`
+    build excludes the overhead of the calls and buffer copies.
+    """
+    fs = int(48e3)
+    signal = primitives.test_signal(fs, length)
+    path_build = path_build / "primitives"
+
+    func = primitives.build_primitive(path_build, path_dsp, "identity")
+    baseline = primitives.measure_primitive(func, "identity", fs, signal, repeats)
+    print(f"{'identity':>16s} {baseline['ns_per_sample']:6.2f} ns/sample")
+
+    results = {"identity": {"default": baseline}}
+    for name in names:
+        variant = primitives.PRIMITIVES[name].variant
+        formulations = primitives.VARIANTS.get(variant, (None,))
+        results[name] = dict()
+        for formulation in formulations:
+            func = primitives.build_primitive(path_build, path_dsp, name, formulation)
+            result = primitives.measure_primitive(func, name, fs, signal, repeats)
+            result["net_ns_per_sample"] = (
+                result["ns_per_sample"] - baseline["ns_per_sample"]
+            )
+            results[name][formulation or "default"] = result
+            print(
+                f"{name:>16s} {formulation or 'default':>10s} "
+                f"{result['ns_per_sample']:6.2f} ns/sample "
+                f"net {result['net_ns_per_sample']:6.2f} ns/sample "
+                f"max err {result['max_error']:.2e}"
+            )
+
+    return results
+
+
+def bench_denormals(
+    path_dsp: Path,
+    path_build: Path,
+    path_headers: Path,
+    class_names: Iterable[str],
+    lead_in: float,
+    repeats: int,
+):
+    """
+    Measure the throughput of each class on a signal and on silence, with and
+    without flushing denormals to zero. The silence follows a `lead_in` (s) of
+    the signal, such that the recursive states decay towards zero through the
+    denormal range rather than starting at zero.
+    """
+    signal, fs = utils.wave_to_numpy(SIGNALS[0])
+    signal = signal.astype("float32")
+    silence = np.zeros_like(signal)
+    num_lead = int(lead_in * fs)
+    silence[:num_lead] = signal[:num_lead]
+
+    results = dict()
+    for class_name in class_names:
+        pars = wrapdsp.run_fausthpp(path_headers, path_dsp, class_name)
+        with (path_headers / f"{class_name}.h").open("r") as fio:
+            code = fio.read()
+        wrapped_code = wrapdsp.wrap_compute(code, class_name, pars)
+        wrapdsp.compile_wrapped(class_name, path_build, path_headers, wrapped_code)
+        func = wrapdsp.make_callable(class_name, path_build)
+        values = func.library.pack(**wrapdsp.default_values(class_name, pars))
+
+        results[class_name] = dict()
+        for flush in (False, True):
+            func.library.flush_denormals = flush
+            result = dict()
+            for name, buffer in (("signal", signal), ("silence", silence)):
+                seconds = bench.time_call(func, fs, buffer, values, repeats=repeats)
+                result[f"{name}_seconds"] = seconds
+                result[f"{name}_realtime"] = len(buffer) / fs / seconds
+            result["slowdown"] = result["silence_seconds"] / result["signal_seconds"]
+            results[class_name]["ftz" if flush else "default"] = result
+            print(
+                f"{class_name:>12s} {'ftz' if flush else 'default':>7s} "
+                f"signal x{result['signal_realtime']:7.1f} "
+                f"silence x{result['silence_realtime']:7.1f} real time "
+                f"silence/signal {result['slowdown']:5.2f}"
+            )
+        func.library.flush_denormals = False
+
+    return results
+
+
+def bench_tonestack(
+    path_dsp: Path,
+    path_build: Path,
+    path_headers: Path,
+    num_signals: int,
+    repeats: int,
+):
+    """
+    Verify the LTI rendering of the `ToneStack` against the compiled class, at
+    the defaults and at random knobs, and compare the time to render the
+    `SIGNALS` end to end, and a batch of `num_signals` copies, with both.
+    """
+    pars = wrapdsp.run_fausthpp(path_headers, path_dsp, "ToneStack")
+    with (path_headers / "ToneStack.h").open("r") as fio:
+        code = fio.read()
+    wrapped_code = wrapdsp.wrap_compute(code, "ToneStack", pars)
+    wrapdsp.compile_wrapped("ToneStack", path_build, path_headers, wrapped_code)
+    func = wrapdsp.make_callable("ToneStack", path_build)
+    lti = tonestack.make_lti_callable(path_dsp)
+
+    fs = int(48e3)
+    rng = np.random.default_rng(0)
+
+    results = {"deviation": list()}
+    for trial in range(4):
+        offsets = dict()
+        if trial > 0:
+            offsets = {p: float(rng.uniform(-1, 1)) for p in pars}
+            offsets["selection"] = float(rng.uniform(0, 2))
+        deviation = tonestack.verify_compiled(func, fs, path_dsp, offsets)
+        results["deviation"].append(deviation)
+        print(f"{'ToneStack':>12s} trial {trial} max deviation {deviation:.2e}")
+
+    signals = list()
+    for path in SIGNALS:
+        signal, fs = utils.wave_to_numpy(path)
+        signals.append(signal)
+    signal = np.concatenate(signals).astype("float32")
+    batch = np.repeat(signal[None, :], num_signals, axis=0)
+    kwargs = wrapdsp.default_values("ToneStack", pars)
+
+    def render_batch():
+        for row in batch:
+            func(fs, row, **kwargs)
+
+    def lti_cold():
+        tonestack.impulse_response.cache_clear()
+        lti(fs, signal, **kwargs)
+
+    results["render_seconds"] = bench.time_call(
+        func, fs, signal, repeats=repeats, **kwargs
+    )
+    results["lti_cold_seconds"] = bench.time_call(lti_cold, repeats=repeats)
+    results["lti_seconds"] = bench.time_call(lti, fs, signal, repeats=repeats, **kwargs)
+    results["render_batch_seconds"] = bench.time_call(render_batch, repeats=repeats)
+    results["lti_batch_seconds"] = bench.time_call(
+        lti, fs, batch, repeats=repeats, **kwargs
+    )
+    print(
+        f"{'ToneStack':>12s} render {results['render_seconds'] * 1e3:8.2f} ms "
+        f"lti {results['lti_seconds'] * 1e3:8.2f} ms "
+        f"(uncached {results['lti_cold_seconds'] * 1e3:8.2f} ms), "
+        f"batch of {num_signals} render "
+        f"{results['render_batch_seconds'] * 1e3:8.2f} ms "
+        f"lti {results['lti_batch_seconds'] * 1e3:8.2f} ms"
+    )
+
+    return results
+
+
+def main(command: str, path_dsp: str, output: str, repeats: int, **kwargs):
+    path_dsp = Path(path_dsp)
+    path_headers = Path("headers")
+    path_build = Path("build") / "benchmark"
+    path_build.mkdir(parents=True, exist_ok=True)
+
+    if command == "profiles":
+        results = bench_profiles(
+            path_dsp,
+            path_build,
+            path_headers,
+            class_names=kwargs["class_names"],
+            profiles=kwargs["profiles"],
+            repeats=repeats,
+        )
+    elif command == "codegen":
+        results = bench_codegen(
+            path_dsp,
+            path_build,
+            path_headers,
+            class_names=kwargs["class_names"],
+            modes=kwargs["modes"],
+            repeats=repeats,
+            tolerance=kwargs["tolerance"],
+            path_best=Path(kwargs["best"]),
+        )
+
+    elif command == "pch":
+        results = bench_pch(
+            path_dsp,
+            path_build,
+            path_headers,
+            class_names=kwargs["class_names"],
+            profile=kwargs["profile"],
+        )
+
+    elif command == "cabinet":
+        results = bench_cabinet(
+            path_dsp,
+            path_build,
+            path_headers,
+            num_candidates=kwargs["num_candidates"],
+            repeats=repeats,
+        )
+
+    elif command == "chunks":
+        results = bench_chunks(
+            path_dsp,
+            path_build,
+            path_headers,
+            class_names=kwargs["class_names"],
+            chunk_length=kwargs["chunk_length"],
+            overlaps=kwargs["overlaps"],
+            num_workers=kwargs["num_workers"],
+        )
+
+    elif command == "primitives":
+        results = bench_primitives(
+            path_dsp,
+            path_build,
+            names=kwargs["names"],
+            length=kwargs["length"],
+            repeats=repeats,
+        )
+
+    elif command == "denormals":
+        results = bench_denormals(
+            path_dsp,
+            path_build,
+            path_headers,
+            class_names=kwargs["class_names"],
+            lead_in=kwargs["lead_in"],
+            repeats=repeats,
+        )
+
+    elif command == "tonestack":
+        results = bench_tonestack(
+            path_dsp,
+            path_build,
+            path_headers,
+            num_signals=kwargs["num_signals"],
+            repeats=repeats,
+        )
+
+    if output:
+        with Path(output).open("w") as fio:
+            json.dump(results, fio, indent="\t")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--path_dsp", type=str, default="dsp")
+    parser.add_argument(
+        "--output", type=str, help="write the results to this JSON file"
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    profiles = commands.add_parser(
+        "profiles", help="compare the compiler optimization profiles"
+    )
+    profiles.add_argument(
+        "--class_names", type=str, nargs="+", default=list(CLASS_NAMES)
+    )
+    profiles.add_argument(
+        "--profiles",
+        type=str,
+        nargs="+",
+        default=list(wrapdsp.BUILD_PROFILES),
+        choices=list(wrapdsp.BUILD_PROFILES),
+        help="the first profile is the reference",
+    )
+
+    codegen = commands.add_parser(
+        "codegen", help="compare the faust code generation modes"
+    )
+    codegen.add_argument(
+        "--class_names", type=str, nargs="+", default=list(CLASS_NAMES)
+    )
+    codegen.add_argument(
+        "--modes",
+        type=str,
+        nargs="+",
+        default=list(wrapdsp.CODEGEN_MODES),
+        choices=list(wrapdsp.CODEGEN_MODES),
+        help="the first mode is the reference",
+    )
+    codegen.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-4,
+        help="largest relative RMS deviation of an accepted mode",
+    )
+    codegen.add_argument(
+        "--best",
+        type=str,
+        default="build/benchmark/codegen.json",
+        help="write the best mode of each class to this JSON file",
+    )
+
+    pch = commands.add_parser(
+        "pch", help="compare compilation times without and with precompiled headers"
+    )
+    pch.add_argument("--class_names", type=str, nargs="+", default=list(CLASS_NAMES))
+    pch.add_argument(
+        "--profile",
+        type=str,
+        default="baseline",
+        choices=list(wrapdsp.BUILD_PROFILES),
+    )
+
+    cab = commands.add_parser(
+        "cabinet", help="verify and time the analytic Cabinet response"
+    )
+    cab.add_argument(
+        "--num_candidates",
+        type=int,
+        default=64,
+        help="number of parameter sets evaluated at once",
+    )
+
+    chunks = commands.add_parser(
+        "chunks", help="compare chunked concurrent renders with sequential ones"
+    )
+    chunks.add_argument("--class_names", type=str, nargs="+", default=list(CLASS_NAMES))
+    chunks.add_argument(
+        "--chunk_length", type=float, default=2.0, help="segment length (s)"
+    )
+    chunks.add_argument(
+        "--overlaps",
+        type=float,
+        nargs="+",
+        default=[0.0, 0.1, 0.5, 1.0],
+        help="warm-up overlaps to compare (s)",
+    )
+    chunks.add_argument("--num_workers", type=int, default=None)
+
+    prims = commands.add_parser(
+        "primitives", help="compare the formulations of the common.dsp primitives"
+    )
+    prims.add_argument(
+        "--names",
+        type=str,
+        nargs="+",
+        default=[n for n in primitives.PRIMITIVES if n != "identity"],
+        choices=[n for n in primitives.PRIMITIVES if n != "identity"],
+    )
+    prims.add_argument(
+        "--length", type=int, default=1 << 20, help="number of samples rendered"
+    )
+
+    denormals = commands.add_parser(
+        "denormals",
+        help="compare the throughput on signal and silence with and without "
+        "flushing denormals to zero",
+    )
+    denormals.add_argument(
+        "--class_names", type=str, nargs="+", default=list(CLASS_NAMES)
+    )
+    denormals.add_argument(
+        "--lead_in",
+        type=float,
+        default=0.5,
+        help="length of the signal preceding the silence (s)",
+    )
+
+    tone = commands.add_parser(
+        "tonestack", help="verify and time the LTI ToneStack rendering"
+    )
+    tone.add_argument(
+        "--num_signals",
+        type=int,
+        default=16,
+        help="number of signals in the batched render",
+    )
+
+    args = parser.parse_args()
+    main(**vars(args))
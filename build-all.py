@@ -22,12 +22,14 @@ are used in the `PushPullAmp` class.
 """
 
 import json
+import shutil
+import time
 from pathlib import Path
 
 import numpy as np
 from matplotlib import pyplot as plt
 
-from dspfit import utils, wrapdsp
+from dspfit import analysis, primitives, utils, wrapdsp
 
 
 def inspect_behaviour(func, kwargs, plot_dir: Path):
@@ -62,7 +64,14 @@ def inspect_behaviour(func, kwargs, plot_dir: Path):
     plt.clf()
 
 
-def main(path_dsp: str, plot_dir: str):
+def main(
+    path_dsp: str,
+    plot_dir: str,
+    codegen: str,
+    no_pch: bool,
+    analysis_json: str,
+    variants: list,
+):
     path_dsp = Path(path_dsp)
     plot_dir = Path(plot_dir) if plot_dir else None
     path_build = Path("build")
@@ -73,8 +82,18 @@ def main(path_dsp: str, plot_dir: str):
     if plot_dir is not None:
         plot_dir = Path(plot_dir)
 
-    # remove previous build files
+    # the faust code generation options of each class, as selected by
+    # `benchmark.py codegen`
+    codegen_options = dict()
+    if codegen:
+        with Path(codegen).open("r") as fio:
+            codegen_options = {c: v["options"] for c, v in json.load(fio).items()}
+
+    # remove previous build files, and the patched headers which would take
+    # precedence over the new ones
     for path in path_build.iterdir():
+        if path.is_dir() and path.name in ("codegen", "monitor", "state"):
+            shutil.rmtree(path)
         if not path.is_file():
             continue
         path.unlink()
@@ -100,7 +119,15 @@ def main(path_dsp: str, plot_dir: str):
     with (path_dsp / "Triode.json").open("w") as fio:
         json.dump(triode_json, fio, indent="\t")
 
+    # build from a copy of the programs with the selected formulations of the
+    # primitives, as compared by `benchmark.py primitives`
+    if variants:
+        selected = dict(v.split("=", 1) for v in variants)
+        path_dsp = primitives.variant_dsp(path_dsp, path_build / "dsp", selected)
+        print(f"selected primitives {selected}")
+
     # build each individual class that makes up the amp
+    built = dict()
     for class_name in (
         "Cabinet",
         "ToneStack",
@@ -108,28 +135,46 @@ def main(path_dsp: str, plot_dir: str):
         "TetrodeGrid",
         "TetrodePlate",
     ):
-        dsp_func, pars = wrapdsp.build_fausthpp(
+        start = time.perf_counter()
+        dsp_func, pars, seconds = wrapdsp.build_fausthpp(
             path_build=path_build,
             path_headers=path_headers,
             path_dsp=path_dsp,
             class_name=class_name,
+            faust_options=codegen_options.get(class_name, ()),
+            pch=not no_pch,
+            compare_pch=not no_pch,
         )
+        # the compilation without the precompiled headers is the baseline
+        compiled = f"compiled in {seconds['nopch']:.2f} s without pch"
+        if "pch" in seconds:
+            compiled += f", {seconds['pch']:.2f} s with pch"
+        print(f"built {class_name} in {time.perf_counter() - start:.2f} s, {compiled}")
+
+        # ship the selected code generation: replace the scalar faust class
+        # which `build_fausthpp` left in the headers
+        if codegen_options.get(class_name):
+            path_codegen = wrapdsp.codegen_dir(path_build, codegen_options[class_name])
+            shutil.copyfile(
+                path_codegen / f"{class_name}Faust.h",
+                path_headers / f"{class_name}Faust.h",
+            )
+
+        # measure with default parameters
+        kwargs = wrapdsp.default_values(class_name, pars)
+        built[class_name] = (dsp_func, kwargs)
 
         if plot_dir is not None:
             class_plot_dir = plot_dir / class_name
             class_plot_dir.mkdir(parents=True, exist_ok=True)
-
-            # measure with default parameters
-            kwargs = {p: 0.0 for p in pars}
-            # triode has parameters controlled by the PushPullAmp which don't
-            # default at zero
-            if class_name == "Triode":
-                kwargs["mix"] = 1.0
-                kwargs["overhead"] = 1.0
-                kwargs["unscale"] = 1.0
-
             inspect_behaviour(dsp_func, kwargs, class_plot_dir)
 
+    if analysis_json:
+        # same renders as `inspect_behaviour`, reduced to numbers
+        metrics = analysis.analyse(built, fs=int(48e3))
+        with Path(analysis_json).open("w") as fio:
+            json.dump(metrics, fio, indent="\t")
+
 
 if __name__ == "__main__":
     import argparse
@@ -137,5 +182,27 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("path_dsp", type=str)
     parser.add_argument("--plot_dir", type=str)
+    parser.add_argument(
+        "--codegen",
+        type=str,
+        help="JSON file with the faust code generation mode of each class",
+    )
+    parser.add_argument(
+        "--no_pch",
+        action="store_true",
+        help="don't precompile the headers common to all classes",
+    )
+    parser.add_argument(
+        "--analysis_json",
+        type=str,
+        help="write numeric metrics of the empty and impulse responses to this file",
+    )
+    parser.add_argument(
+        "--variants",
+        type=str,
+        nargs="+",
+        metavar="PRIMITIVE=FORMULATION",
+        help="formulations of the primitives in common.dsp, e.g. power_clip_full=series",
+    )
     args = parser.parse_args()
     main(**vars(args))
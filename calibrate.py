@@ -23,6 +23,8 @@ Used to build the calibration curves found in `PushPullAmp`. See `README.md`
 for more information on how to use this.
 """
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Callable, Mapping
 
@@ -32,82 +34,83 @@ from dspfit import simdata, utils, wrapdsp
 
 
 def calibrate_sweep(
-    push_pull: Callable, push_pull_pars: Mapping[str, float], parameter: str
+    push_pull_level: Callable,
+    push_pull_pars: Mapping[str, float],
+    parameter: str,
+    signal: np.ndarray,
+    fs: int,
+    num_points: int = 11,
+    num_workers: int = None,
 ):
-    signal, fs = utils.wave_to_numpy("data/signal.wav")
-    if len(signal.shape) == 2:
-        signal = signal[:, 0]
+    """
+    Measure the ratio of input to output level for `num_points` values of
+    `parameter` evenly spaced in [-1, +1].
+
+    The sweep points are independent of one another so they are rendered
+    concurrently. The native calls release the GIL, so threads are enough to
+    use all cores with a single loaded library.
+    """
+    level1 = np.std(signal)
+
+    par_values = push_pull_level.library.pack(**push_pull_pars)
+    ipar = push_pull_level.parameters.index(parameter)
 
-    values = list()
-    kwargs = push_pull_pars.copy()
-    for value in np.linspace(-1, +1, 10 + 1):
-        kwargs[parameter] = value
-        level1 = np.std(signal)
-        amplified = push_pull(fs, signal, **kwargs)[0]
-        level2 = np.std(amplified)
+    def measure(value: float) -> float:
+        point_values = par_values.copy()
+        point_values[ipar] = value
+        level2 = push_pull_level(fs, signal, point_values)
+        return level1 / level2
 
-        factor = level1 / level2
-        values.append(factor)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        values = list(pool.map(measure, np.linspace(-1, +1, num_points)))
 
     print(",".join([f"{v:.6e}f" for v in values]))
 
 
-def main():
+def main(num_points: int, num_workers: int):
     path_headers = Path("headers")
     path_build = Path("build")
 
     with (path_headers / "PushPullAmp.h").open("r") as fio:
         code = fio.read()
 
-    push_pull_pars = {
-        # a typical configuration
-        "triode_num_stages": 3,
-        "triode_overhead": 0,
-        "triode_hp_freq": 0,
-        "triode_grid_tau": 0,
-        "triode_grid_ratio": 0,
-        "triode_grid_level": 0,
-        "triode_grid_clip": 0,
-        "triode_plate_bias": 0,
-        "triode_plate_comp_ratio": 0,
-        "triode_plate_comp_level": 0,
-        "triode_plate_comp_offset": 0,
-        "triode_drive": 0,
-        "tetrode_hp_freq": 0,
-        "tetrode_grid_tau": 0,
-        "tetrode_grid_ratio": 0,
-        "tetrode_plate_comp_depth": 0,
-        "tetrode_plate_sag_tau": 0,
-        # sag will result in significant loudness fluctuations over time
-        "tetrode_plate_sag_toggle": -1,
-        "tetrode_plate_sag_depth": 0,
-        "tetrode_plate_sag_ratio": 0,
-        "tetrode_plate_sag_factor": 0,
-        "tetrode_drive": 0,
-        "tonestack_bass": 0,
-        "tonestack_mids": 0,
-        "tonestack_treble": 0,
-        "tonestack_selection": 0,
-        "cabinet_brightness": 0,
-        "cabinet_distance": 0,
-        "cabinet_dynamic": 0,
-        "input_level": 0,
-        "output_level": 0,
-    }
+    push_pull_pars = dict(wrapdsp.PUSH_PULL_PARS)
 
     wrapped = wrapdsp.wrap_compute(code, "PushPullAmp", push_pull_pars.keys())
     wrapdsp.compile_wrapped("PushPullAmp", path_build, path_headers, wrapped)
-    push_pull = wrapdsp.make_callable("PushPullAmp", path_build, push_pull_pars.keys())
+    push_pull_level = wrapdsp.make_level_callable("PushPullAmp", path_build)
+
+    signal, fs = utils.wave_to_numpy("data/signal.wav")
+    if len(signal.shape) == 2:
+        signal = signal[:, 0]
+    signal = np.ascontiguousarray(signal, dtype="float32")
 
+    sweep_kwargs = {"num_points": num_points, "num_workers": num_workers}
     print("pre amp sweep:")
-    calibrate_sweep(push_pull, push_pull_pars, "triode_drive")
+    calibrate_sweep(
+        push_pull_level, push_pull_pars, "triode_drive", signal, fs, **sweep_kwargs
+    )
     print("power amp sweep:")
-    calibrate_sweep(push_pull, push_pull_pars, "tetrode_drive")
+    calibrate_sweep(
+        push_pull_level, push_pull_pars, "tetrode_drive", signal, fs, **sweep_kwargs
+    )
 
 
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num_points",
+        type=int,
+        default=11,
+        help="number of drive values in the sweep, the PushPullAmp tables use 11",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of sweep points rendered concurrently",
+    )
     args = parser.parse_args()
     main(**vars(args))
@@ -16,6 +16,13 @@
 
 import("stdfaust.lib");
 
+// Formulation of the primitives, selected at build time by rewriting these
+// constants (see `dspfit.primitives.VARIANTS`). The selectors are constant,
+// so only the selected formulation is compiled.
+power_clip_variant = 0;
+power_clip_full_variant = 0;
+calc_charge_cap_variant = 0;
+
 ftanh = ftanh
 with {
     ftanh1 = max(-1, min(+1, _ / 3.4));
@@ -38,11 +45,21 @@ letrec {
     'c = c + tau1 * max(0, s - c) - tau2 * c;
 };
 
-calc_charge_cap(tau1, tau2, cap, s) = c
+calc_charge_cap_divide(tau1, tau2, cap, s) = c
 letrec {
     'c = c + tau1 * max(0, cap - c) / cap * max(0, s - c) - tau2 * c;
 };
 
+// the reciprocal of the slow `cap` is computed once per block
+calc_charge_cap_recip(tau1, tau2, cap, s) = c
+letrec {
+    'c = c + tau1 * (1 / cap) * max(0, cap - c) * max(0, s - c) - tau2 * c;
+};
+
+calc_charge_cap(tau1, tau2, cap) = _
+    <: calc_charge_cap_divide(tau1, tau2, cap), calc_charge_cap_recip(tau1, tau2, cap)
+    : ba.selectn(2, calc_charge_cap_variant);
+
 // Apply soft clipping (tanh) to the portion of a signal between `scale` and
 // `level`. The signal won't exceed `level`.
 soft_clip_up(scale, level) = _ 
@@ -71,19 +88,61 @@ mix_wet_dry(mix, wet, dry) = mix * wet + (1 - mix) * dry;
 
 power_clip = power_clip
 with {
-    power_clip_full(power, bias) = _
+    power_clip_pow(power, bias) = _
         : +(bias)
         : max(0)
         : ^(power)
         : -(bias^power)
         : _;
 
+    // Least squares fit of u^power over [0, series_range] by a quartic in
+    // sqrt(u), from the projections on the shifted Legendre polynomials. The
+    // coefficients depend on the slow `power` only, so they are computed once
+    // per block and a sample costs a square root and the quartic. Exact for
+    // the multiples of 0.5 up to 2, beyond `series_range` it extrapolates.
+    power_clip_series(power, bias) = _
+        : +(bias)
+        : max(0)
+        : series
+        : -(series(bias))
+        : _
+    with {
+        series_range = 5;
+        a = 2 * power;
+        l0 = 1 / (a + 1);
+        l1 = l0 * 3 * a / (a + 2);
+        l2 = l1 * 5 / 3 * (a - 1) / (a + 3);
+        l3 = l2 * 7 / 5 * (a - 2) / (a + 4);
+        l4 = l3 * 9 / 7 * (a - 3) / (a + 5);
+        c0 = l0 - l1 + l2 - l3 + l4;
+        c1 = 2 * l1 - 6 * l2 + 12 * l3 - 20 * l4;
+        c2 = 6 * l2 - 30 * l3 + 90 * l4;
+        c3 = 20 * l3 - 140 * l4;
+        c4 = 70 * l4;
+        series(u) = series_range^power * (c0 + s * (c1 + s * (c2 + s * (c3 + s * c4))))
+        with {
+            s = sqrt(u * (1 / series_range));
+        };
+    };
+
+    power_clip_full(power, bias) = _
+        <: power_clip_pow(power, bias), power_clip_series(power, bias)
+        : ba.selectn(2, power_clip_full_variant);
+
     power_clip_approx(power, bias) = _
         : bias^(power - 1) * power * _ 
         : _;
 
     // when signal is large w.r.t. bias, this goes to 1
-    factor(bias, s) = max(0, min(1, ( abs(s) / max(abs(s), abs(bias)) - 0.05 ) / (0.1 - 0.05) ));
+    factor_blend(bias, s) = max(0, min(1, ( abs(s) / max(abs(s), abs(bias)) - 0.05 ) / (0.1 - 0.05) ));
+
+    // the same ramp without a division per sample, the reciprocal of the
+    // slow `bias` is computed once per block
+    factor_branchless(bias, s) = max(0, min(1, abs(s) * (20 / abs(bias)) - 1));
+
+    factor(bias) = _
+        <: factor_blend(bias), factor_branchless(bias)
+        : ba.selectn(2, power_clip_variant);
 
     power_clip(power, bias) = _ 
         <: mix_wet_dry(
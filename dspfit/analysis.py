@@ -0,0 +1,161 @@
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Numeric analysis of the time and frequency behaviour of the DSP classes.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Mapping, Tuple
+
+import numpy as np
+
+
+def render_responses(
+    funcs: Mapping[str, Tuple[Callable, Mapping[str, float]]],
+    fs: int,
+    length: int,
+    num_workers: int = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Render an empty buffer and a buffer with an impulse at its centre through
+    each function. The renders run concurrently, the native calls release the
+    GIL.
+
+    Args:
+        funcs: for each name, the dsp function and its keyword arguments
+        fs: sampling rate
+        length: number of samples in the buffers
+        num_workers: number of concurrent renders
+
+    Returns:
+        the empty and impulse outputs, arrays of shape (len(funcs), length)
+    """
+    zeros = np.zeros(length, dtype="float32")
+    pulse = np.zeros(length, dtype="float32")
+    pulse[length // 2] = 1
+
+    def render(item: Tuple[Callable, Mapping[str, float]], signal: np.ndarray):
+        func, kwargs = item
+        return func(fs, signal, **kwargs)[0]
+
+    items = list(funcs.values())
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        empty = list(pool.map(lambda i: render(i, zeros), items))
+        impulse = list(pool.map(lambda i: render(i, pulse), items))
+
+    return np.array(empty), np.array(impulse)
+
+
+def response_metrics(
+    fs: int,
+    empty: np.ndarray,
+    impulse: np.ndarray,
+    settle_tolerance: float = 1e-3,
+) -> List[Dict[str, float]]:
+    """
+    Calculate metrics of a batch of responses rendered by `render_responses`.
+
+    The impulse response is the difference between the impulse and empty
+    outputs from the impulse onward, which removes the start-up transient.
+
+    Args:
+        fs: sampling rate
+        empty: outputs for an empty buffer, shape (batch, samples)
+        impulse: outputs for a centred impulse, shape (batch, samples)
+        settle_tolerance: the empty output is settled once its deviation from
+            its final value stays below this fraction of its largest deviation
+
+    Returns:
+        for each response, the DC offset and settling time (s) of the empty
+        output, and the energy, -3 dB corners (Hz, None if the response
+        doesn't fall that low) and group delay (s) at the peak and over the
+        pass band (between the corners) of the impulse response
+    """
+    empty = np.asarray(empty, dtype="float64")
+    impulse = np.asarray(impulse, dtype="float64")
+    num_samples = empty.shape[1]
+
+    # DC offset and settling of the empty output
+    final = np.mean(empty[:, -max(1, num_samples // 10) :], axis=1)
+    dev = np.abs(empty - final[:, None])
+    threshold = settle_tolerance * np.max(dev, axis=1) + 1e-12
+    unsettled = dev > threshold[:, None]
+    settle_index = np.where(
+        np.any(unsettled, axis=1),
+        num_samples - np.argmax(unsettled[:, ::-1], axis=1),
+        0,
+    )
+
+    # the impulse response with the start-up transient removed
+    response = (impulse - empty)[:, num_samples // 2 :]
+    energy = np.sum(response ** 2, axis=1)
+
+    spectrum = np.fft.rfft(response, axis=1)
+    freqs = np.fft.rfftfreq(response.shape[1], 1.0 / fs)
+    bins = np.arange(len(freqs))[None, :]
+
+    mag = 20 * np.log10(np.abs(spectrum) + 1e-20)
+    peak = np.argmax(mag, axis=1)
+    cutoff = mag < np.max(mag, axis=1)[:, None] - 3
+
+    # the last bin below the corner before the peak, and the first after it
+    low = np.max(np.where(cutoff & (bins < peak[:, None]), bins, -1), axis=1)
+    high = np.min(np.where(cutoff & (bins > peak[:, None]), bins, len(freqs)), axis=1)
+
+    omega = 2 * np.pi * freqs / fs
+    phase = np.unwrap(np.angle(spectrum), axis=1)
+    group_delay = -np.gradient(phase, omega, axis=1) / fs
+
+    band = (bins > low[:, None]) & (bins < high[:, None])
+    group_delay_band = np.where(band, group_delay, np.nan)
+
+    metrics = list()
+    for i in range(empty.shape[0]):
+        metrics.append(
+            {
+                "dc_offset": float(final[i]),
+                "settling_time": float(settle_index[i] / fs),
+                "impulse_energy": float(energy[i]),
+                "corner_low": float(freqs[low[i] + 1]) if low[i] >= 0 else None,
+                "corner_high": (
+                    float(freqs[high[i] - 1]) if high[i] < len(freqs) else None
+                ),
+                "group_delay_peak": float(group_delay[i, peak[i]]),
+                "group_delay_band": float(np.nanmedian(group_delay_band[i])),
+            }
+        )
+
+    return metrics
+
+
+def analyse(
+    funcs: Mapping[str, Tuple[Callable, Mapping[str, float]]],
+    fs: int,
+    length: int = None,
+    num_workers: int = None,
+) -> Dict[str, Dict[str, float]]:
+    """
+    Render and measure the responses of several dsp functions, see
+    `render_responses` and `response_metrics`.
+
+    Returns:
+        the metrics of each function
+    """
+    length = length or fs
+    empty, impulse = render_responses(funcs, fs, length, num_workers)
+    metrics = response_metrics(fs, empty, impulse)
+    return {name: m for name, m in zip(funcs, metrics)}
@@ -0,0 +1,63 @@
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Timing and accuracy measurements of compiled DSP builds.
+"""
+
+import time
+from typing import Callable, Dict
+
+import numpy as np
+
+
+def time_call(func: Callable, *args, repeats: int = 5, **kwargs) -> float:
+    """
+    Measure the wall time of a function call.
+
+    Args:
+        func: the function to call
+        args: positional arguments to pass to the function
+        repeats: number of times to call the function
+        kwargs: keyword arguments to pass to the function
+
+    Returns:
+        the shortest of the call durations in seconds
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def deviation(reference: np.ndarray, output: np.ndarray) -> Dict[str, float]:
+    """
+    Measure how far an output deviates from a reference output.
+
+    Returns:
+        the maximum absolute difference, and the RMS of the difference
+        relative to the RMS of the reference
+    """
+    reference = np.asarray(reference, dtype="float64")
+    output = np.asarray(output, dtype="float64")
+    diff = output - reference
+    scale = np.sqrt(np.mean(reference ** 2))
+    return {
+        "max_abs": float(np.max(np.abs(diff))),
+        "rel_rms": float(np.sqrt(np.mean(diff ** 2)) / (scale + 1e-12)),
+    }
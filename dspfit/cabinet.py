@@ -0,0 +1,306 @@
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Analytic frequency response of the `Cabinet` EQ chain.
+
+The filters mirror their definitions in the faust `filters.lib`: each is an
+analog prototype mapped to the z-plane with a bilinear transform prewarped at
+its corner frequency, such that its response at frequency `f` is that of the
+prototype at `s = j tan(pi f / fs) / tan(pi fc / fs)`.
+"""
+
+import json
+import re
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Mapping, Tuple, Union
+
+import numpy as np
+import scipy as sp
+import scipy.signal
+
+from dspfit.utils import FitData
+
+NUM_PEAKS = 10
+
+_TRANSFORM = re.compile(r"(ul|u)scale\(x,\s*([^,]+?)f?,\s*([^)]+?)f?\)")
+
+Values = Mapping[str, Union[float, np.ndarray]]
+
+
+def _ftanh(x: np.ndarray) -> np.ndarray:
+    """The polynomial tanh approximation of `common.dsp`."""
+    x = np.clip(x / 3.4, -1, +1)
+    x = (np.abs(x) - 2) * x
+    return (np.abs(x) - 2) * x
+
+
+def _db2linear(level: np.ndarray) -> np.ndarray:
+    return 10 ** (level / 20)
+
+
+def absolute_values(
+    path_dsp: Path, offsets: Values, class_name: str = "Cabinet"
+) -> Dict[str, np.ndarray]:
+    """
+    Parameter values seen by the faust code, given the offsets passed to the
+    compiled class: the JSON default is added and the JSON transform applied.
+
+    Args:
+        path_dsp: directory with the JSON parameters of the class
+        offsets: offset of each parameter, scalars or arrays of candidates
+        class_name: the class whose parameters these are
+
+    Returns:
+        the absolute value of each parameter, arrays of shape (candidates,)
+    """
+    with (path_dsp / f"{class_name}.json").open("r") as fio:
+        pars_info = json.load(fio)
+
+    values = dict()
+    for par, info in pars_info.items():
+        x = np.atleast_1d(offsets.get(par, 0.0)) + float(info.get("default", 0))
+        if "transform" in info:
+            kind, vmin, vmax = _TRANSFORM.match(info["transform"]).groups()
+            vmin, vmax = float(vmin), float(vmax)
+            if kind == "u":
+                x = (x + 1) / 2 * (vmax - vmin) + vmin
+            else:
+                x = np.exp((x + 1) / 2 * (np.log(vmax) - np.log(vmin)) + np.log(vmin))
+        values[par] = x.astype("float64")
+
+    return values
+
+
+def dynamic_gain(values: Mapping[str, np.ndarray], level: float) -> np.ndarray:
+    """
+    The gain of the dynamic term for a steady input `level`, which is the
+    smoothed absolute value of the signal entering the cabinet.
+    """
+    gain_low = 0.05 * values["dynamic_level"]
+    gain_high = np.maximum(gain_low * 2.0, 0.5 * values["dynamic_level"])
+    gain = (level - gain_low) / (gain_high - gain_low)
+    return (_ftanh((gain - 0.5) * 2.0) + 1.0) / 2.0
+
+
+def _prewarped_s(freqs: np.ndarray, fc: np.ndarray, fs: int) -> np.ndarray:
+    """Normalized s of the prewarped bilinear transform, shape (*fc, freqs)."""
+    fc = np.asarray(fc, dtype="float64")[..., None]
+    return 1j * np.tan(np.pi * freqs / fs) / np.tan(np.pi * fc / fs)
+
+
+def butterworth(
+    freqs: np.ndarray, fc: np.ndarray, fs: int, order: int, highpass: bool = False
+) -> np.ndarray:
+    """Response of `fi.lowpass(order, fc)` or `fi.highpass(order, fc)`."""
+    s = _prewarped_s(freqs, fc, fs)
+    response = np.ones_like(s)
+    for k in range(order // 2):
+        a1 = 2 * np.sin(np.pi * (2 * k + 1) / (2 * order))
+        response *= (s ** 2 if highpass else 1) / (s ** 2 + a1 * s + 1)
+    if order % 2:
+        response *= (s if highpass else 1) / (s + 1)
+    return response
+
+
+def shelf(
+    freqs: np.ndarray,
+    level: np.ndarray,
+    fc: np.ndarray,
+    fs: int,
+    order: int = 3,
+    high: bool = False,
+) -> np.ndarray:
+    """
+    Response of `fi.low_shelf(level, fc)` or `fi.high_shelf(level, fc)`, or
+    `fi.highshelf(order, level, fc)`. These split the signal with the two
+    bands of `fi.filterbank`, a low and a high pass of odd `order` which sum
+    to an allpass, and add them with the low or the high band scaled.
+    """
+    gain = _db2linear(np.asarray(level, dtype="float64"))[..., None]
+    lowpass = butterworth(freqs, fc, fs, order)
+    highpass = butterworth(freqs, fc, fs, order, highpass=True)
+    if high:
+        return lowpass + gain * highpass
+    return gain * lowpass + highpass
+
+
+def peak_eq(
+    freqs: np.ndarray, level: np.ndarray, fc: np.ndarray, bandwidth: np.ndarray, fs
+) -> np.ndarray:
+    """
+    Response of `fi.peak_eq(level, fc, bandwidth)`, for arrays of sections
+    which broadcast together, shape (*sections, freqs).
+    """
+    level, fc, bandwidth = np.broadcast_arrays(
+        *(np.asarray(a, dtype="float64") for a in (level, fc, bandwidth))
+    )
+    s = _prewarped_s(freqs, fc, fs)
+    # the bandwidth is prewarped too
+    a1 = (np.pi * bandwidth / fs / np.sin(2 * np.pi * fc / fs))[..., None]
+    gain = _db2linear(np.abs(level))[..., None]
+    boost = (level > 0)[..., None]
+    # the pole sets the bandwidth of a boost, the zero that of a cut
+    b1s = np.where(boost, gain * a1, a1)
+    a1s = np.where(boost, a1, gain * a1)
+    return (s ** 2 + b1s * s + 1) / (s ** 2 + a1s * s + 1)
+
+
+def cabinet_response(
+    freqs: np.ndarray, fs: int, values: Mapping[str, np.ndarray], level: float = 0.0
+) -> np.ndarray:
+    """
+    Transfer function of the cabinet EQ chain for a batch of candidates.
+
+    The dynamic term varies slowly with the input level, it is evaluated for
+    a steady `level` (see `dynamic_gain`).
+
+    Args:
+        freqs: frequencies at which to evaluate the response (Hz)
+        fs: sampling rate
+        values: absolute parameter values, arrays of shape (candidates,), see
+            `absolute_values`
+        level: smoothed absolute value of the input
+
+    Returns:
+        the complex response, of shape (candidates, freqs)
+    """
+    v = dict(zip(values, np.broadcast_arrays(*values.values())))
+    dynamic = v["dynamic"] * dynamic_gain(v, level)
+    brightness = v["brightness"]
+    distance = v["distance"]
+    ones = np.ones_like(dynamic)
+
+    response = butterworth(freqs, v["hp_f"], fs, 4, highpass=True)
+    response *= butterworth(freqs, v["lp_f"], fs, 3)
+    response *= shelf(freqs, v["shelf_l"], v["shelf_f"], fs, order=7, high=True)
+
+    # all the peaking sections in one (candidates, sections, freqs) product
+    levels = [v[f"peak_{i}_l"] for i in range(1, NUM_PEAKS + 1)]
+    centres = [v[f"peak_{i}_f"] for i in range(1, NUM_PEAKS + 1)]
+    widths = [v[f"peak_{i}_b"] for i in range(1, NUM_PEAKS + 1)]
+    levels[7] = levels[7] + 5 * dynamic
+    centres[7] = centres[7] - 500 * dynamic
+    widths[7] = widths[7] + 200 * dynamic
+
+    levels += [v["scoop_l"], -5 * ones, 15 * brightness, -10 * distance, -17 * distance]
+    centres += [v["scoop_f"], 100 * ones, 6000 * ones, 70 * ones, 1200 * ones]
+    widths += [v["scoop_b"], 200 * ones, 1000 * ones, 100 * ones, 300 * ones]
+
+    sections = peak_eq(
+        freqs,
+        np.stack(levels, axis=-1),
+        np.stack(centres, axis=-1),
+        np.stack(widths, axis=-1),
+        fs,
+    )
+    response *= np.prod(sections, axis=-2)
+
+    response *= shelf(freqs, -3 * brightness + 3 * dynamic, 1100 * ones, fs)
+    response *= shelf(freqs, -5 * dynamic, 6500 * ones, fs, high=True)
+    response *= _db2linear(2 * distance + v["offset"])[:, None]
+
+    return response
+
+
+def render_compiled(
+    func: Callable, fs: int, offsets: Values, signal: np.ndarray
+) -> Tuple[Dict[str, float], np.ndarray]:
+    """
+    Render a signal through a compiled class made by `wrapdsp.make_callable`
+    with the given offsets, the others at zero.
+
+    Returns:
+        the offsets of all the parameters and the float64 output
+    """
+    kwargs = {p: float(offsets.get(p, 0.0)) for p in func.parameters}
+    return kwargs, func(fs, signal, **kwargs)[0].astype("float64")
+
+
+def verify_compiled(
+    func: Callable,
+    fs: int,
+    path_dsp: Path,
+    offsets: Values,
+    length: int = 1 << 16,
+    f_min: float = 20.0,
+    f_max: float = 20e3,
+) -> float:
+    """
+    Compare the analytic response with the impulse response of the compiled
+    class made by `wrapdsp.make_callable`. The impulse barely moves the input
+    level, so the dynamic term is evaluated for silence.
+
+    Returns:
+        the largest deviation of the magnitudes between `f_min` and `f_max` (dB)
+    """
+    impulse = np.zeros(length, dtype="float32")
+    impulse[0] = 1
+    kwargs, rendered = render_compiled(func, fs, offsets, impulse)
+    rendered = np.fft.rfft(rendered)
+    freqs = np.fft.rfftfreq(length, 1.0 / fs)
+
+    analytic = cabinet_response(freqs, fs, absolute_values(path_dsp, kwargs))[0]
+
+    band = (freqs >= f_min) & (freqs <= f_max)
+    deviation = 20 * np.log10(np.abs(rendered[band]) / np.abs(analytic[band]))
+    return float(np.max(np.abs(deviation)))
+
+
+def make_response_loss(
+    datas: Iterable[FitData],
+    path_dsp: Path,
+    num_freqs: int = 256,
+    f_min: float = 40.0,
+    f_max: float = 16e3,
+    nperseg: int = 8192,
+) -> Callable:
+    """
+    Make a frequency-domain loss for `utils.fit_sim_data`, which compares the
+    analytic magnitude response with the response measured from each dataset
+    (the cross spectrum of input and output over the input spectrum). The
+    loss replaces the renders in the fit.
+
+    The returned function takes the parameter offsets, scalars or arrays of
+    candidates, and returns the mean squared deviation of the magnitudes
+    (dB^2) over `num_freqs` log-spaced frequencies, for each candidate.
+    """
+    measured = list()
+    for data in datas:
+        freqs, pxx = sp.signal.welch(data.signal_in, data.fs, nperseg=nperseg)
+        _, pxy = sp.signal.csd(
+            data.signal_in, data.signal_out, data.fs, nperseg=nperseg
+        )
+        # sample the response evenly per octave
+        targets = np.geomspace(f_min, f_max, num_freqs)
+        bins = np.unique(np.searchsorted(freqs, targets))
+        magnitude = 20 * np.log10(np.abs(pxy[bins] / pxx[bins]) + 1e-12)
+        level = float(np.mean(np.abs(data.signal_in)))
+        measured.append((data.fs, freqs[bins], magnitude, level))
+
+    def loss(offsets: Values) -> Union[float, np.ndarray]:
+        values = absolute_values(path_dsp, offsets)
+        err = 0
+        for fs, freqs, magnitude, level in measured:
+            response = cabinet_response(freqs, fs, values, level)
+            model = 20 * np.log10(np.abs(response) + 1e-12)
+            err = err + np.mean((model - magnitude[None, :]) ** 2, axis=1)
+        err = err / len(measured)
+        if all(np.ndim(v) == 0 for v in offsets.values()):
+            return float(err[0])
+        return err
+
+    return loss
@@ -0,0 +1,246 @@
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compact references of the rendered outputs, against which later builds are
+compared to verify that an optimization didn't change the sound.
+
+A reference keeps the output decimated by `DECIMATION`, the RMS level of its
+short blocks, its spectrum on log-spaced bands and a hash of its samples.
+The hash tells if a build is bit-identical, the other metrics how far it
+drifted otherwise. The decimated signal is compared sample-wise, such that
+a polarity flip or a shift of the output fails even if its levels match.
+"""
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Mapping, Tuple
+
+import numpy as np
+import scipy as sp
+import scipy.signal
+
+from dspfit import utils
+
+# largest deviation of each metric accepted by `compare`
+TOLERANCES = {
+    # RMS of the sample-wise deviation of the decimated signal, relative to
+    # the RMS of the golden one
+    "signal_rel": 1e-2,
+    # level of the blocks (dB), ignoring blocks below `FLOOR_DB`
+    "block_level_db": 0.1,
+    # level of the spectral bands (dB), ignoring bands below `FLOOR_DB`
+    "spectrum_db": 0.5,
+    # relative deviation of the overall RMS level
+    "rms_rel": 1e-3,
+    # relative deviation of the peak level
+    "peak_rel": 1e-2,
+}
+
+FLOOR_DB = -80.0
+
+BLOCK_SIZE = 256
+NUM_BANDS = 96
+DECIMATION = 8
+
+
+def _db(power: np.ndarray) -> np.ndarray:
+    return 10 * np.log10(np.maximum(power, 1e-20))
+
+
+def reference(output: np.ndarray, fs: int) -> Dict[str, np.ndarray]:
+    """The compact reference of an output signal."""
+    output = np.asarray(output, dtype="float32")
+    signal = output.astype("float64")
+
+    num_blocks = max(1, len(signal) // BLOCK_SIZE)
+    blocks = signal[: num_blocks * BLOCK_SIZE].reshape(num_blocks, -1)
+    block_level = _db(np.mean(blocks ** 2, axis=1))
+
+    freqs, power = sp.signal.welch(signal, fs, nperseg=min(4096, len(signal)))
+    # average the bins in bands of equal width in octaves
+    edges = np.geomspace(20.0, fs / 2, NUM_BANDS + 1)
+    index = np.digitize(freqs, edges) - 1
+    spectrum = np.full(NUM_BANDS, FLOOR_DB * 2)
+    for band in np.unique(index[(index >= 0) & (index < NUM_BANDS)]):
+        spectrum[band] = _db(np.mean(power[index == band]))
+
+    return {
+        "signal": sp.signal.resample_poly(signal, 1, DECIMATION).astype("float32"),
+        "block_level_db": block_level.astype("float32"),
+        "spectrum_db": spectrum.astype("float32"),
+        "rms": np.float64(np.sqrt(np.mean(signal ** 2))),
+        "peak": np.float64(np.max(np.abs(signal), initial=0.0)),
+        "sha1": hashlib.sha1(output.tobytes()).hexdigest(),
+    }
+
+
+def deviations(
+    golden: Mapping[str, np.ndarray], current: Mapping[str, np.ndarray]
+) -> Dict[str, float]:
+    """Deviation of each metric of `TOLERANCES` between two references."""
+
+    def level_deviation(key: str) -> float:
+        a, b = golden[key], current[key]
+        if a.shape != b.shape:
+            return float("inf")
+        audible = (a > FLOOR_DB) | (b > FLOOR_DB)
+        return float(np.max(np.abs(a - b)[audible], initial=0.0))
+
+    def relative_deviation(key: str) -> float:
+        return float(abs(current[key] - golden[key]) / max(golden[key], 1e-12))
+
+    def signal_deviation() -> float:
+        a = golden["signal"].astype("float64")
+        b = current["signal"].astype("float64")
+        if a.shape != b.shape:
+            return float("inf")
+        scale = max(np.sqrt(np.mean(a ** 2)), 1e-12)
+        return float(np.sqrt(np.mean((a - b) ** 2)) / scale)
+
+    return {
+        "signal_rel": signal_deviation(),
+        "block_level_db": level_deviation("block_level_db"),
+        "spectrum_db": level_deviation("spectrum_db"),
+        "rms_rel": relative_deviation("rms"),
+        "peak_rel": relative_deviation("peak"),
+    }
+
+
+def render_references(
+    funcs: Mapping[str, Tuple[Callable, Mapping[str, float]]],
+    signals: Mapping[str, Tuple[np.ndarray, int]],
+    num_workers: int = None,
+) -> Dict[str, Dict[str, dict]]:
+    """
+    Render every signal through every class and reduce the outputs to their
+    references. The renders run on concurrent threads, the native calls
+    release the GIL.
+
+    Args:
+        funcs: dsp function and parameter values of each class
+        signals: input signal and sampling rate by name
+
+    Returns:
+        the references by class and signal name
+    """
+    jobs = [(c, s) for c in funcs for s in signals]
+
+    def process(job: Tuple[str, str]) -> dict:
+        func, kwargs = funcs[job[0]]
+        signal, fs = signals[job[1]]
+        return reference(func(fs, signal, **kwargs)[0], fs)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        results = list(pool.map(process, jobs))
+
+    references = {c: dict() for c in funcs}
+    for (class_name, signal_name), result in zip(jobs, results):
+        references[class_name][signal_name] = result
+    return references
+
+
+def save(path: Path, references: Mapping[str, Mapping[str, dict]]):
+    """
+    Write the references to a directory: the arrays of each class in an npz
+    file, the scalars and hashes of all classes in `golden.json`.
+    """
+    path.mkdir(parents=True, exist_ok=True)
+    summary = dict()
+    for class_name, by_signal in references.items():
+        arrays = dict()
+        summary[class_name] = dict()
+        for signal_name, ref in by_signal.items():
+            for key, value in ref.items():
+                if isinstance(value, np.ndarray):
+                    arrays[f"{signal_name}/{key}"] = value
+            summary[class_name][signal_name] = {
+                k: v if isinstance(v, str) else float(v)
+                for k, v in ref.items()
+                if not isinstance(v, np.ndarray)
+            }
+        np.savez_compressed(path / f"{class_name}.npz", **arrays)
+
+    with (path / "golden.json").open("w") as fio:
+        json.dump(summary, fio, indent="\t")
+
+
+def load(path: Path) -> Dict[str, Dict[str, dict]]:
+    """Read the references written by `save`."""
+    with (path / "golden.json").open("r") as fio:
+        summary = json.load(fio)
+
+    references = dict()
+    for class_name, by_signal in summary.items():
+        with np.load(path / f"{class_name}.npz") as arrays:
+            references[class_name] = {s: dict(v) for s, v in by_signal.items()}
+            for key in arrays.files:
+                signal_name, metric = key.split("/")
+                references[class_name][signal_name][metric] = arrays[key]
+    return references
+
+
+def compare(
+    golden: Mapping[str, Mapping[str, dict]],
+    current: Mapping[str, Mapping[str, dict]],
+    tolerances: Mapping[str, float] = None,
+) -> Dict[str, Dict[str, dict]]:
+    """
+    Compare the references of a build with the golden ones. A class or
+    signal missing from either side fails, with infinite deviations.
+
+    Returns:
+        for each class and signal, the deviation of each metric, whether it
+        is bit-identical, whether all the deviations are within the
+        `TOLERANCES`, updated with `tolerances`, and the side it is missing
+        from if any ("golden" or "build")
+    """
+    tolerances = {**TOLERANCES, **(tolerances or dict())}
+
+    results = dict()
+    for class_name in golden.keys() | current.keys():
+        by_golden = golden.get(class_name, dict())
+        by_current = current.get(class_name, dict())
+        results[class_name] = dict()
+        for signal_name in by_golden.keys() | by_current.keys():
+            if signal_name not in by_golden or signal_name not in by_current:
+                result = {k: float("inf") for k in TOLERANCES}
+                result["identical"] = False
+                result["passed"] = False
+                result["missing"] = "golden" if signal_name in by_current else "build"
+                results[class_name][signal_name] = result
+                continue
+            a = by_golden[signal_name]
+            b = by_current[signal_name]
+            result = deviations(a, b)
+            result["identical"] = a["sha1"] == b["sha1"]
+            result["passed"] = result["identical"] or all(
+                result[k] <= tolerances[k] for k in TOLERANCES
+            )
+            result["missing"] = None
+            results[class_name][signal_name] = result
+    return results
+
+
+def load_signals(paths: Iterable[Path]) -> Dict[str, Tuple[np.ndarray, int]]:
+    """The mono float32 signals of the wave files by file stem."""
+    signals = dict()
+    for path in paths:
+        signal, fs = utils.wave_to_numpy(str(path))
+        signals[Path(path).stem] = (np.ascontiguousarray(signal, dtype="float32"), fs)
+    return signals
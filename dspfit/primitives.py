@@ -0,0 +1,258 @@
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Standalone builds of the primitives of `common.dsp`, their reference
+implementations and the build time selection of their formulations.
+"""
+
+import json
+import re
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, Mapping, NamedTuple
+
+import numpy as np
+
+from dspfit import wrapdsp
+
+# the formulations of each variant selector of `common.dsp`, in the order of
+# the selector values
+VARIANTS = {
+    "power_clip": ("blend", "branchless"),
+    "power_clip_full": ("pow", "series"),
+    "calc_charge_cap": ("divide", "recip"),
+}
+
+
+def _ftanh(x: np.ndarray) -> np.ndarray:
+    # the shipped formulation, which the models were fitted with, such that
+    # the errors measure the drift from it rather than from tanh
+    x = np.clip(x / 3.4, -1, +1)
+    x = (np.abs(x) - 2) * x
+    return (np.abs(x) - 2) * x
+
+
+def _soft_clip_up(x: np.ndarray, scale: float, level: float) -> np.ndarray:
+    x = x - (level - scale)
+    x = np.minimum(x, 0) + _ftanh(np.maximum(x, 0) / scale) * scale
+    return x + (level - scale)
+
+
+def _soft_clip_down(x: np.ndarray, scale: float, level: float) -> np.ndarray:
+    x = x - (level + scale)
+    x = _ftanh(np.minimum(x, 0) / scale) * scale + np.maximum(x, 0)
+    return x + (level + scale)
+
+
+def _power_clip(x: np.ndarray, power: float, bias: float) -> np.ndarray:
+    full = np.maximum(0, x + bias) ** power - bias ** power
+    approx = bias ** (power - 1) * power * x
+    # the blend of `common.dsp`, such that only the formulations differ
+    factor = np.clip(20 * np.abs(x) / np.maximum(np.abs(x), abs(bias)) - 1, 0, 1)
+    return factor * full + (1 - factor) * approx
+
+
+def _calc_charge(x: np.ndarray, tau1: float, tau2: float) -> np.ndarray:
+    out = np.zeros_like(x)
+    c = 0.0
+    for i, s in enumerate(x):
+        out[i] = c
+        c = c + tau1 * max(0.0, s - c) - tau2 * c
+    return out
+
+
+def _calc_charge_cap(x: np.ndarray, tau1: float, tau2: float, cap: float):
+    out = np.zeros_like(x)
+    c = 0.0
+    for i, s in enumerate(x):
+        out[i] = c
+        c = c + tau1 * max(0.0, cap - c) / cap * max(0.0, s - c) - tau2 * c
+    return out
+
+
+class Primitive(NamedTuple):
+    """
+    A primitive of `common.dsp` as a standalone faust program.
+
+    Attributes:
+        expression: faust expression of the program, in terms of `args`
+        args: value of each argument, exposed as a parameter
+        reference: exact float64 implementation, called with the input
+            signal and the `args`
+        variant: the selector of `VARIANTS` which applies, if any
+    """
+
+    expression: str
+    args: Mapping[str, float]
+    reference: Callable
+    variant: str = None
+
+
+PRIMITIVES = {
+    "identity": Primitive("_", {}, lambda x: x),
+    "ftanh": Primitive("ftanh", {}, _ftanh),
+    "soft_clip_up": Primitive(
+        "soft_clip_up(scale, level)", {"scale": 0.2, "level": 0.6}, _soft_clip_up
+    ),
+    "soft_clip_down": Primitive(
+        "soft_clip_down(scale, level)", {"scale": 0.2, "level": -0.6}, _soft_clip_down
+    ),
+    "power_clip": Primitive(
+        "power_clip(power, bias)",
+        {"power": 1.3, "bias": 0.5},
+        _power_clip,
+        "power_clip",
+    ),
+    "power_clip_full": Primitive(
+        "power_clip(power, bias)",
+        {"power": 1.3, "bias": 0.5},
+        _power_clip,
+        "power_clip_full",
+    ),
+    "calc_charge": Primitive(
+        "calc_charge(tau1, tau2)", {"tau1": 1e-2, "tau2": 1e-4}, _calc_charge
+    ),
+    "calc_charge_cap": Primitive(
+        "calc_charge_cap(tau1, tau2, cap)",
+        {"tau1": 1e-2, "tau2": 1e-4, "cap": 0.8},
+        _calc_charge_cap,
+        "calc_charge_cap",
+    ),
+}
+
+_PRIMITIVE_CODE = """import("stdfaust.lib");
+import("common.dsp");
+
+{args}
+process = {expression};
+"""
+
+
+def variant_dsp(path_dsp: Path, path_out: Path, variants: Mapping[str, str]) -> Path:
+    """
+    Copy the faust programs and their parameters to `path_out`, with the
+    formulation of the primitives in `common.dsp` selected by `variants`
+    (see `VARIANTS`).
+
+    Returns:
+        `path_out`, to use as the dsp directory of a build
+    """
+    path_out.mkdir(parents=True, exist_ok=True)
+    for path in path_dsp.iterdir():
+        if path.suffix in (".dsp", ".json"):
+            shutil.copyfile(path, path_out / path.name)
+
+    with (path_out / "common.dsp").open("r") as fio:
+        code = fio.read()
+
+    for selector, formulation in variants.items():
+        if selector not in VARIANTS:
+            raise ValueError(f"no variants of {selector}, see VARIANTS")
+        if formulation not in VARIANTS[selector]:
+            raise ValueError(
+                f"{selector} has no formulation {formulation}, "
+                f"only {VARIANTS[selector]}"
+            )
+        index = VARIANTS[selector].index(formulation)
+        code, count = re.subn(
+            rf"^{selector}_variant = \d+;",
+            f"{selector}_variant = {index};",
+            code,
+            flags=re.MULTILINE,
+        )
+        if count != 1:
+            raise RuntimeError(f"can't find the {selector} selector in common.dsp")
+
+    with (path_out / "common.dsp").open("w") as fio:
+        fio.write(code)
+
+    return path_out
+
+
+def primitive_class_name(name: str, formulation: str = None) -> str:
+    parts = name.split("_") + ([formulation] if formulation else [])
+    return "Prim" + "".join(p.capitalize() for p in parts)
+
+
+def build_primitive(
+    path_build: Path, path_dsp: Path, name: str, formulation: str = None
+) -> Callable:
+    """
+    Build a primitive of `PRIMITIVES` as a standalone class, with the given
+    formulation of its variant selector. The faust program, headers and
+    library are placed in `path_build`.
+
+    Returns:
+        the dsp function, see `wrapdsp.make_callable`
+    """
+    primitive = PRIMITIVES[name]
+    class_name = primitive_class_name(name, formulation)
+
+    variants = dict()
+    if formulation is not None:
+        variants[primitive.variant] = formulation
+    path_variant = variant_dsp(path_dsp, path_build / class_name / "dsp", variants)
+
+    args = "".join(f'{a} = nentry("{a}",0,0,1,1);\n' for a in primitive.args)
+    with (path_variant / f"{class_name}.dsp").open("w") as fio:
+        fio.write(_PRIMITIVE_CODE.format(args=args, expression=primitive.expression))
+    with (path_variant / f"{class_name}.json").open("w") as fio:
+        json.dump({a: {"default": v} for a, v in primitive.args.items()}, fio)
+
+    path_headers = path_build / class_name / "headers"
+    path_headers.mkdir(parents=True, exist_ok=True)
+    pars = wrapdsp.run_fausthpp(path_headers, path_variant, class_name)
+    with (path_headers / f"{class_name}.h").open("r") as fio:
+        code = fio.read()
+    wrapped_code = wrapdsp.wrap_compute(code, class_name, pars)
+    wrapdsp.compile_wrapped(class_name, path_build, path_headers, wrapped_code)
+
+    return wrapdsp.make_callable(class_name, path_build)
+
+
+def test_signal(fs: int, length: int) -> np.ndarray:
+    """
+    A signal sweeping the range [-4, +4] of the primitives, with a slowly
+    varying envelope such that the charges rise and fall.
+    """
+    time = np.arange(length) / fs
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 0.5 * time)
+    return (4 * envelope * np.sin(2 * np.pi * 110 * time)).astype("float32")
+
+
+def measure_primitive(
+    func: Callable, name: str, fs: int, signal: np.ndarray, repeats: int = 5
+) -> Dict[str, float]:
+    """
+    Measure the render time of a primitive built by `build_primitive` and its
+    deviation from the reference implementation.
+
+    Returns:
+        the time per sample (ns) and the maximum absolute error
+    """
+    from dspfit import bench
+
+    primitive = PRIMITIVES[name]
+    kwargs = {a: 0.0 for a in primitive.args}
+    output = func(fs, signal, **kwargs)[0]
+    reference = primitive.reference(signal.astype("float64"), **primitive.args)
+    seconds = bench.time_call(func, fs, signal, repeats=repeats, **kwargs)
+
+    return {
+        "ns_per_sample": seconds / len(signal) * 1e9,
+        "max_error": float(np.max(np.abs(output - reference))),
+    }
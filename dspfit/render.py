@@ -0,0 +1,165 @@
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Rendering of long signals.
+"""
+
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+
+from dspfit import bench, utils, wrapdsp
+
+
+def render_chunked(
+    func: Callable,
+    fs: int,
+    signal: np.ndarray,
+    chunk_length: float,
+    overlap: float,
+    values: np.ndarray = None,
+    num_workers: int = None,
+    lti: bool = False,
+    **kwargs,
+) -> np.ndarray:
+    """
+    Render a long signal as segments on concurrent threads, the native calls
+    release the GIL. Each segment is rendered by a fresh instance which first
+    runs through `overlap` seconds of the preceding signal, such that its
+    state has mostly caught up with that of a sequential render, and the
+    warm-up output is dropped when stitching the segments.
+
+    With `lti`, the whole signal is rendered at once by the LTI render
+    attached to `func` (see `tonestack.with_lti`), which is exact and
+    needs no segments.
+
+    Args:
+        func: dsp function made by `wrapdsp.make_callable`
+        fs: sampling rate
+        signal: the mono input signal
+        chunk_length: length of the segments (s)
+        overlap: warm-up length of the segments after the first (s)
+        values: parameter values, or given as `kwargs`
+        lti: render through `func.lti`
+
+    Returns:
+        the output signal
+    """
+    values = func.library.pack(values, **kwargs)
+    if lti:
+        if not hasattr(func, "lti"):
+            raise ValueError("func has no LTI render, see tonestack.with_lti")
+        return func.lti(fs, signal, values)[0]
+
+    num_chunk = max(1, int(chunk_length * fs))
+    num_overlap = int(overlap * fs)
+
+    def render(start: int) -> np.ndarray:
+        lead = min(start, num_overlap)
+        segment = signal[start - lead : start + num_chunk]
+        return func(fs, segment, values)[0][lead:]
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        segments = list(pool.map(render, range(0, len(signal), num_chunk)))
+
+    return np.concatenate(segments)
+
+
+def chunked_error(
+    func: Callable,
+    fs: int,
+    signal: np.ndarray,
+    chunk_length: float,
+    overlap: float,
+    values: np.ndarray = None,
+    num_workers: int = None,
+    **kwargs,
+) -> Dict[str, float]:
+    """
+    Compare `render_chunked` with a sequential render of the same signal.
+
+    Returns:
+        the deviation of the chunked output (see `bench.deviation`) and the
+        time of both renders (s)
+    """
+    values = func.library.pack(values, **kwargs)
+    reference = func(fs, signal, values)[0]
+    output = render_chunked(
+        func, fs, signal, chunk_length, overlap, values, num_workers=num_workers
+    )
+
+    return {
+        **bench.deviation(reference, output),
+        "sequential_seconds": bench.time_call(func, fs, signal, values),
+        "chunked_seconds": bench.time_call(
+            render_chunked,
+            func,
+            fs,
+            signal,
+            chunk_length,
+            overlap,
+            values,
+            num_workers=num_workers,
+        ),
+    }
+
+
+def render_file(
+    library: wrapdsp.DspLibrary,
+    values: np.ndarray,
+    path_in: Path,
+    path_out: Path,
+    block_size: int = 1 << 16,
+) -> Tuple[float, float]:
+    """
+    Stream a wave file through a dsp instance a block at a time, writing
+    each processed block before the next is read. The output is mono, with
+    the sample rate and width of the input.
+
+    Returns:
+        the duration of the audio and the wall time of the render (s)
+    """
+    start = time.perf_counter()
+
+    with wave.open(str(path_in), "rb") as reader:
+        fs = reader.getframerate()
+        sampwidth = reader.getsampwidth()
+        num_channels = reader.getnchannels()
+
+        instance = wrapdsp.DspInstance(library, fs)
+        instance.set_params(values)
+
+        with wave.open(str(path_out), "wb") as writer:
+            writer.setnchannels(1)
+            writer.setsampwidth(sampwidth)
+            writer.setframerate(fs)
+
+            num_samples = 0
+            while True:
+                frames = reader.readframes(block_size)
+                if not frames:
+                    break
+                block = utils.pcm_to_numpy(frames, num_channels, sampwidth)
+                instance.process(block)
+                writer.writeframes(utils.numpy_to_pcm(block, sampwidth))
+                num_samples += len(block)
+
+    return num_samples / fs, time.perf_counter() - start
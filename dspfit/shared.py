@@ -0,0 +1,190 @@
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Datasets placed once in shared memory, such that process pool workers read
+them as zero-copy views instead of receiving pickled copies.
+
+The owner creates a `SharedFitData` and passes its `handle`, a small
+picklable description of the layout, to the workers, which call `attach`:
+
+    with shared.SharedFitData(datas) as store:
+        with ProcessPoolExecutor() as pool:
+            pool.map(work, repeat(store.handle), ...)
+
+    def work(handle, ...):
+        datas = shared.attach(handle)
+"""
+
+import multiprocessing
+import os
+import sys
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+import numpy as np
+
+from dspfit.utils import FitData
+
+# the array fields of `FitData`, the others are stored in the handle
+_ARRAYS = ("time", "signal_in", "signal_out", "mask")
+
+# arrays start on cache line boundaries
+_ALIGN = 64
+
+
+class _ArraySpec(NamedTuple):
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+class _DataSpec(NamedTuple):
+    fs: int
+    name: str
+    arrays: Tuple[_ArraySpec, ...]
+
+
+class SharedHandle(NamedTuple):
+    """Picklable description of a `SharedFitData`, see `attach`."""
+
+    segment: str
+    datas: Tuple[_DataSpec, ...]
+    # pid of the process which created the segment
+    owner: int
+
+
+# segments created by this process, attaching to them returns the owner views
+_owned: Dict[str, "SharedFitData"] = weakref.WeakValueDictionary()
+
+# segments attached by this process, with their views, kept open until exit
+_attached: Dict[str, Tuple[shared_memory.SharedMemory, List[FitData]]] = dict()
+
+
+def _views(buffer: memoryview, handle: SharedHandle) -> List[FitData]:
+    datas = list()
+    for spec in handle.datas:
+        arrays = [
+            np.ndarray(a.shape, dtype=a.dtype, buffer=buffer, offset=a.offset)
+            for a in spec.arrays
+        ]
+        datas.append(FitData(spec.fs, *arrays, spec.name))
+    return datas
+
+
+def _release(shm: shared_memory.SharedMemory, unlink: bool):
+    try:
+        shm.close()
+    except BufferError:
+        # views are still referenced, the mapping goes with the process
+        pass
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class SharedFitData:
+    """
+    A copy of datasets in a single shared memory segment. The views in
+    `datas` are read-only, as are those returned by `attach`.
+
+    The segment is removed by `close`, when leaving the context, when the
+    store is garbage collected or at interpreter exit. If the owner process
+    is killed, the multiprocessing resource tracker removes it.
+    """
+
+    def __init__(self, datas: Iterable[FitData]):
+        datas = list(datas)
+
+        specs = list()
+        size = 0
+        for data in datas:
+            arrays = list()
+            for field in _ARRAYS:
+                array = np.asarray(getattr(data, field))
+                arrays.append(_ArraySpec(size, array.shape, array.dtype.str))
+                size += -(-max(array.nbytes, 1) // _ALIGN) * _ALIGN
+            specs.append(_DataSpec(int(data.fs), data.name, tuple(arrays)))
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.handle = SharedHandle(self.shm.name, tuple(specs), os.getpid())
+        self.datas = _views(self.shm.buf, self.handle)
+
+        for data, view in zip(datas, self.datas):
+            for field in _ARRAYS:
+                getattr(view, field)[...] = getattr(data, field)
+                getattr(view, field).flags.writeable = False
+
+        _owned[self.shm.name] = self
+        self._finalizer = weakref.finalize(self, _release, self.shm, True)
+
+    def close(self):
+        """Release the views and remove the segment."""
+        _owned.pop(self.shm.name, None)
+        self.datas = list()
+        self._finalizer()
+
+    def __enter__(self) -> "SharedFitData":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _attach_segment(handle: SharedHandle) -> shared_memory.SharedMemory:
+    # the owner is responsible for the segment, it mustn't stay registered with
+    # a resource tracker which would remove it when this process exits
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=handle.segment, track=False)
+
+    shm = shared_memory.SharedMemory(name=handle.segment)
+    # the workers started by the owner share its resource tracker, with which
+    # the segment is already registered: unregistering would drop the owner's
+    # registration, so only other processes undo theirs
+    parent = multiprocessing.parent_process()
+    if parent is None or parent.pid != handle.owner:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def attach(handle: SharedHandle) -> List[FitData]:
+    """
+    Zero-copy views of the datasets of a `SharedFitData`, from any process.
+    A process maps each segment once, later calls return the same views.
+    """
+    if handle.segment in _owned:
+        return _owned[handle.segment].datas
+
+    if handle.segment not in _attached:
+        shm = _attach_segment(handle)
+        datas = _views(shm.buf, handle)
+        for data in datas:
+            for field in _ARRAYS:
+                getattr(data, field).flags.writeable = False
+        _attached[handle.segment] = (shm, datas)
+        weakref.finalize(shm, _release, shm, False)
+
+    return _attached[handle.segment][1]
+
+
+def detach(handle: SharedHandle):
+    """Unmap a segment attached by `attach`, the views must be released."""
+    shm, _ = _attached.pop(handle.segment, (None, None))
+    if shm is not None:
+        _release(shm, False)
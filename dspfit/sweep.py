@@ -0,0 +1,225 @@
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Frequency responses over grids of parameter values, measured with an
+exponential sine sweep.
+"""
+
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Mapping, Sequence, Tuple
+
+import numpy as np
+
+
+def exp_sweep(
+    fs: int, f_start: float, f_stop: float, duration: float, fade: float = 0.05
+) -> np.ndarray:
+    """
+    Build an exponential sine sweep, which spends equal time in each octave.
+
+    Args:
+        fs: sampling rate
+        f_start: start frequency of the sweep (Hz)
+        f_stop: stop frequency of the sweep (Hz)
+        duration: duration of the sweep (s)
+        fade: duration of the fade in and out (s)
+
+    Returns:
+        the sweep
+    """
+    num_samples = int(duration * fs)
+    time = np.arange(num_samples) / fs
+    rate = np.log(f_stop / f_start)
+    sweep = np.sin(
+        2 * np.pi * f_start * duration / rate * (np.exp(time * rate / duration) - 1)
+    )
+
+    # fade the ends to limit the ripple from switching the sweep on and off
+    num_fade = int(fade * fs)
+    fade_in = np.sin(np.linspace(0, np.pi / 2, num_fade)) ** 2
+    sweep[:num_fade] *= fade_in
+    sweep[num_samples - num_fade :] *= fade_in[::-1]
+
+    return sweep
+
+
+def deconvolve(
+    outputs: np.ndarray,
+    signal: np.ndarray,
+    ir_length: int,
+    regularization: float = 1e-6,
+) -> np.ndarray:
+    """
+    Recover the impulse responses from a batch of responses to `signal`.
+
+    The spectra are divided by the spectrum of `signal`, regularized where it
+    has little energy (outside of the sweep range). For an exponential sweep,
+    the harmonic distortion products of a non-linear system land at negative
+    times, at the end of the circular buffer, and are dropped.
+
+    Args:
+        outputs: responses to `signal`, shape (batch, samples)
+        signal: the excitation signal
+        ir_length: number of impulse response samples to keep
+        regularization: fraction of the peak signal power added to the
+            denominator of the division
+
+    Returns:
+        the impulse responses, shape (batch, ir_length)
+    """
+    num_fft = 2 ** int(np.ceil(np.log2(2 * outputs.shape[1])))
+    spectrum = np.fft.rfft(signal, num_fft)
+    power = np.abs(spectrum) ** 2
+    inverse = np.conj(spectrum) / (power + regularization * np.max(power))
+    responses = np.fft.rfft(outputs, num_fft, axis=1) * inverse[None, :]
+    return np.fft.irfft(responses, num_fft, axis=1)[:, :ir_length]
+
+
+class SweepResponses:
+    """
+    Frequency responses over a grid of parameter values. The grid is the
+    product of the values along each axis, and the responses are indexed by
+    the nearest grid point such that they can be queried without rendering.
+    """
+
+    def __init__(
+        self,
+        fs: int,
+        axes: Mapping[str, Sequence[float]],
+        responses: np.ndarray,
+        ir_length: int,
+    ):
+        self.fs = fs
+        self.axes = {n: np.asarray(v, dtype="float32") for n, v in axes.items()}
+        self.responses = responses
+        self.ir_length = ir_length
+
+    @property
+    def freqs(self) -> np.ndarray:
+        return np.fft.rfftfreq(self.ir_length, 1.0 / self.fs)
+
+    def index(self, **kwargs) -> Tuple[int, ...]:
+        """
+        Index of the grid point nearest to the given axis values. Axes which
+        aren't given must have a single value.
+        """
+        index = list()
+        for name, values in self.axes.items():
+            if name not in kwargs and len(values) > 1:
+                raise ValueError(f"a value is needed for the {name} axis")
+            value = kwargs.get(name, values[0])
+            index.append(int(np.argmin(np.abs(values - value))))
+        return tuple(index)
+
+    def response(self, **kwargs) -> np.ndarray:
+        """Complex frequency response at the grid point nearest `kwargs`."""
+        return self.responses[self.index(**kwargs)]
+
+    def impulse_response(self, **kwargs) -> np.ndarray:
+        """Impulse response at the grid point nearest `kwargs`."""
+        return np.fft.irfft(self.response(**kwargs), self.ir_length)
+
+    def save(self, path: Path):
+        np.savez(
+            str(path),
+            fs=self.fs,
+            ir_length=self.ir_length,
+            axis_names=np.array(list(self.axes)),
+            responses=self.responses,
+            **{f"axis_{n}": v for n, v in self.axes.items()},
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> "SweepResponses":
+        with np.load(str(path)) as data:
+            return cls(
+                fs=int(data["fs"]),
+                axes={str(n): data[f"axis_{n}"] for n in data["axis_names"]},
+                responses=data["responses"],
+                ir_length=int(data["ir_length"]),
+            )
+
+
+def measure_grid(
+    func: Callable,
+    fs: int,
+    axes: Mapping[str, Sequence[float]],
+    defaults: Mapping[str, float],
+    f_start: float = 20.0,
+    f_stop: float = 20e3,
+    duration: float = 2.0,
+    ir_length: int = 8192,
+    amplitude: float = 0.5,
+    batch_size: int = 64,
+    num_workers: int = None,
+) -> SweepResponses:
+    """
+    Render a sweep through `func` at every point of the grid spanned by
+    `axes`, and deconvolve the renders to frequency responses.
+
+    The grid points are rendered concurrently, the native calls release the
+    GIL, and deconvolved a batch at a time to bound the memory used.
+
+    Args:
+        func: dsp function made by `wrapdsp.make_callable`
+        fs: sampling rate
+        axes: the values of each parameter spanning the grid
+        defaults: values of all parameters, those in `axes` are replaced
+        f_start: start frequency of the sweep (Hz)
+        f_stop: stop frequency of the sweep (Hz)
+        duration: duration of the sweep (s)
+        ir_length: number of impulse response samples to keep, which sets
+            the frequency resolution
+        amplitude: amplitude of the sweep, matters to level dependent classes
+            such as `Cabinet` with its dynamic term
+        batch_size: number of grid points to deconvolve at once
+        num_workers: number of concurrent renders
+
+    Returns:
+        the responses, of shape (*axis lengths, ir_length // 2 + 1)
+    """
+    # leave room for the response to decay after the sweep
+    sweep = exp_sweep(fs, f_start, f_stop, duration)
+    signal = np.concatenate([amplitude * sweep, np.zeros(ir_length)])
+
+    base = func.library.pack(**defaults)
+    indices = [func.parameters.index(n) for n in axes]
+    points = list(itertools.product(*axes.values()))
+
+    def render(point: Sequence[float]) -> np.ndarray:
+        values = base.copy()
+        values[indices] = point
+        return func(fs, signal, values)[0]
+
+    shape = tuple(len(v) for v in axes.values())
+    responses = np.zeros((len(points), ir_length // 2 + 1), dtype="complex64")
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for start in range(0, len(points), batch_size):
+            batch = points[start : start + batch_size]
+            outputs = np.array(list(pool.map(render, batch)), dtype="float64")
+            irs = deconvolve(outputs, signal, ir_length)
+            responses[start : start + len(batch)] = np.fft.rfft(irs, axis=1)
+
+    return SweepResponses(
+        fs=fs,
+        axes=axes,
+        responses=responses.reshape(shape + (-1,)),
+        ir_length=ir_length,
+    )
@@ -0,0 +1,345 @@
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Linear time-invariant rendering of the `ToneStack`.
+
+For fixed knobs the tone stack is a weighted sum of the bilinear transfer
+functions of `ToneStack.dsp`, followed by peaking EQs. Its impulse response
+is derived from the same coefficients, cached per setting, and applied to
+signals by FFT convolution instead of the sample by sample recursion.
+"""
+
+import functools
+from pathlib import Path
+from typing import Callable, Iterable, List, Tuple
+
+import numpy as np
+import scipy as sp
+import scipy.signal
+
+from dspfit import cabinet
+
+# in the order of `ToneStack.json`
+PARAMETERS = ("bass", "mids", "treble", "presence", "selection")
+
+# a section is the (numerator, denominator) of a biquad in z^-1
+Section = Tuple[np.ndarray, np.ndarray]
+
+
+def _bilinear(b: Tuple[float, ...], a: Tuple[float, ...], c: float) -> Section:
+    """
+    Map `(b0 + b1 s + b2 s^2) / (a0 + a1 s + a2 s^2)` to the z-plane with
+    `s = c (1 - z^-1) / (1 + z^-1)`, as written out in `ToneStack.dsp`.
+    """
+
+    def z_poly(p):
+        return np.array(
+            [
+                p[0] + p[1] * c + p[2] * c * c,
+                2.0 * p[0] - 2.0 * p[2] * c * c,
+                p[0] - p[1] * c + p[2] * c * c,
+            ]
+        )
+
+    bz, az = z_poly(b), z_poly(a)
+    return bz / az[0], az / az[0]
+
+
+def _marshall_l(bass0: float) -> float:
+    return 0.2 * bass0 if bass0 <= 0.5 else 1.6 * bass0 - 0.7
+
+
+def _fender(bass, treble, mids, c) -> List[Tuple[float, Section]]:
+    l2 = (0.495 * bass + 0.505) ** 2
+    t = 0.495 * treble + 0.505
+    m = 0.495 * mids + 0.505
+
+    C1, C2, R1, R2, R3, Ri = 100.0e-9, 47.0e-9, 100.0e3, 250.0e3, 10.0e3, 38.0e3
+    b = (0.0, (m * C2 + m * C1) * R3 + l2 * C1 * R2, l2 * m * C1 * C2 * R2 * R3)
+    a = (
+        1.0,
+        (m * C2 + m * C1) * R3 + l2 * C1 * R2 + (C2 + C1) * R1 + Ri * C2 + Ri * C1,
+        l2 * m * C1 * C2 * R2 * R3 + (l2 * C1 * C2 * R1 + l2 * Ri * C1 * C2) * R2,
+    )
+    mids_bass = _bilinear(b, a, c)
+
+    C1, R1, R2, Ri = 250.0e-12, 100.0e3, 250.0e3, 38.0e3
+    b = (0.0, t * C1 * R1 * R1, 0.0)
+    a = (R1 + Ri, ((R1 + Ri) * R2 + Ri * R1) * C1, 0.0)
+    treble = _bilinear(b, a, c)
+
+    return [(12.0, treble), (4.0, mids_bass)]
+
+
+def _marshall(bass, treble, mids, c) -> List[Tuple[float, Section]]:
+    l = _marshall_l(0.495 * bass + 0.505)
+    t = 0.495 * treble + 0.505
+    m = 0.495 * mids + 0.505
+
+    C1, C2, R1, R2, R3, Ri = 22.0e-9, 22.0e-9, 33.0e3, 1.0e6, 22.0e3, 0.0
+    b = (
+        0.0,
+        (-m * C2 - C1) * R3 - l * C1 * R2,
+        ((m * m - m) * R3 * R3 - l * m * R2 * R3) * C1 * C2,
+    )
+    a = (
+        -1.0,
+        (-m * C2 - C1) * R3 - l * C1 * R2 + (-C2 - C1) * R1 - Ri * C2 - Ri * C1,
+        (
+            (m * m - m) * R3 * R3
+            + (-l * m * R2 + (m - 1) * R1 + (m - 1) * Ri) * R3
+            + (-l * R1 - l * Ri) * R2
+        )
+        * C1
+        * C2,
+    )
+    mids_bass = _bilinear(b, a, c)
+
+    C1, R1, R2, Ri = 470e-12, 33000.0, 220000.0, 0.0
+    b = (0.0, t * C1 * R1 * R1, 0.0)
+    a = (R1 + Ri, ((R1 + Ri) * R2 + Ri * R1) * C1, 0.0)
+    treble = _bilinear(b, a, c)
+
+    return [(6.0, treble), (1.4, mids_bass)]
+
+
+def _ac30(bass, treble, c) -> List[Tuple[float, Section]]:
+    l = _marshall_l(0.495 * bass + 0.505)
+    t = 0.495 * treble + 0.505
+
+    C1, C2, R1, R2, R3, R4, R5, Ri = (
+        22.0e-9,
+        100.0e-9,
+        100.0e3,
+        10.0e3,
+        250.0e3,
+        250.0e3,
+        150000.0,
+        56.0e3,
+    )
+    ll = l * l - l
+    b = (
+        0.0,
+        (ll * C2 * R4 * R4 + ((l - 1) * C1 - C2) * R2 * R4) * R5,
+        ll * C1 * C2 * R2 * R4 * R4 * R5,
+    )
+    a2 = (
+        ((R2 + R1 + Ri) * ll * C1 * C2 * R4 * R4 - (R1 + Ri) * l * C1 * C2 * R2 * R4)
+        * R5
+        + ((R2 + R1 + Ri) * ll * t * C1 * C2 * R3 + (R1 + Ri) * ll * C1 * C2 * R2)
+        * R4
+        * R4
+        - (R1 + Ri) * l * t * C1 * C2 * R2 * R3 * R4
+    )
+    a1 = (
+        (
+            ll * C2 * R4 * R4
+            + (C1 * R2 + (C2 + C1) * R1 + Ri * C2 + Ri * C1) * (l - 1) * R4
+            - R2 * C2 * R4
+            + ((-C2 - C1) * R1 - Ri * C2 - Ri * C1) * R2
+        )
+        * R5
+        + (t * C2 * R3 + C1 * R2 + (C2 + C1) * R1 + Ri * C2 + Ri * C1) * ll * R4 * R4
+        + (
+            (
+                ((l - 1) * t * C1 - t * C2) * R2
+                + ((l - 1) * t * C2 + (l - 1) * t * C1) * R1
+                + (l - 1) * Ri * t * C2
+                + (l - 1) * Ri * t * C1
+            )
+            * R3
+            + ((-C2 - C1) * R1 - Ri * C2 - Ri * C1) * R2
+        )
+        * R4
+        + ((-t * C2 - t * C1) * R1 - Ri * t * C2 - Ri * t * C1) * R2 * R3
+    )
+    a0 = (
+        ((l - 1) * R4 - R2) * R5
+        + ll * R4 * R4
+        + ((l - 1) * t * R3 - R2) * R4
+        - t * R2 * R3
+    )
+    bass_section = _bilinear(b, (a0, a1, a2), c)
+
+    C1, R1, R2, R3, Ri = 560.0e-12, 100.0e3, 10.0e3, 250.0e3, 48.0e3
+    b = (R2, ((R2 + t * R1) * R3 + R1 * R2) * C1, 0.0)
+    a = (R2 + R1 + Ri, ((R2 + R1 + Ri) * R3 + R1 * (R2 + Ri)) * C1, 0.0)
+    treble_section = _bilinear(b, a, c)
+
+    return [(1.5, treble_section), (8.0, bass_section)]
+
+
+def _peak_eq(level: float, fc: float, bandwidth: float, fs: int) -> Section:
+    """The biquad of `fi.peak_eq`, see `cabinet.peak_eq` for its response."""
+    a1 = np.pi * bandwidth / fs / np.sin(2 * np.pi * fc / fs)
+    gain = 10 ** (abs(level) / 20)
+    b1s, a1s = (gain * a1, a1) if level > 0 else (a1, gain * a1)
+    return _bilinear((1.0, b1s, 1.0), (1.0, a1s, 1.0), 1 / np.tan(np.pi * fc / fs))
+
+
+def _response_length(ir: np.ndarray, tolerance: float) -> int:
+    """Samples holding all but a `tolerance` fraction of the energy."""
+    energy = np.cumsum(ir[::-1] ** 2)[::-1]
+    tail = energy <= tolerance * energy[0]
+    return int(np.argmax(tail)) if np.any(tail) else len(ir)
+
+
+@functools.lru_cache(maxsize=128)
+def impulse_response(
+    fs: int,
+    bass: float,
+    treble: float,
+    mids: float,
+    presence: float,
+    selection: float,
+    max_length: float = 1.0,
+    tolerance: float = 1e-20,
+) -> np.ndarray:
+    """
+    Impulse response of the tone stack for absolute knob values (see
+    `cabinet.absolute_values`), truncated where its remaining energy is a
+    `tolerance` fraction of the total, and at `max_length` seconds.
+
+    The responses of the most recent settings are cached, the returned array
+    is shared and read-only.
+    """
+    c = float(fs)
+    weight_fender = 1.0 - min(max(selection, 0.0), 1.0)
+    weight_ac30 = min(max(selection, 1.0), 2.0) - 1.0
+    weight_marshall = 1.0 - min(max(abs(selection - 1.0), 0.0), 1.0)
+
+    impulse = np.zeros(int(max_length * fs))
+    impulse[0] = 1.0
+
+    ir = np.zeros_like(impulse)
+    for weight, sections, peak in (
+        (weight_fender, _fender(bass, treble, mids, c), None),
+        (weight_marshall, _marshall(bass, treble, mids, c), None),
+        (weight_ac30, _ac30(bass, treble, c), _peak_eq(10.0 * mids, 1e3, 2e3, fs)),
+    ):
+        if weight == 0:
+            continue
+        branch = sum(g * sp.signal.lfilter(b, a, impulse) for g, (b, a) in sections)
+        if peak is not None:
+            branch = sp.signal.lfilter(*peak, branch)
+        ir += weight * branch
+
+    ir = sp.signal.lfilter(*_peak_eq(10.0 * presence, 4e3, 2e3, fs), ir)
+
+    ir = ir[: max(1, _response_length(ir, tolerance))]
+    ir.flags.writeable = False
+    return ir
+
+
+def fft_convolve(
+    signals: np.ndarray, ir: np.ndarray, block_size: int = 1 << 14
+) -> np.ndarray:
+    """
+    Convolve signals with an impulse response by overlap-add, all the blocks
+    of all the signals transformed at once.
+
+    Args:
+        signals: array of shape (..., samples)
+        ir: the impulse response
+        block_size: number of input samples per block
+
+    Returns:
+        the causal output, of the same shape as `signals`
+    """
+    signals = np.asarray(signals)
+    length = signals.shape[-1]
+    block_size = min(block_size, max(length, 1))
+    num_blocks = -(-length // block_size)
+    nfft = 1 << int(np.ceil(np.log2(block_size + len(ir) - 1)))
+
+    padded = np.zeros(signals.shape[:-1] + (num_blocks * block_size,))
+    padded[..., :length] = signals
+    blocks = padded.reshape(signals.shape[:-1] + (num_blocks, block_size))
+
+    spectra = np.fft.rfft(blocks, nfft) * np.fft.rfft(ir, nfft)
+    outputs = np.fft.irfft(spectra, nfft)
+
+    # each block spills over into the following ones
+    total = np.zeros(signals.shape[:-1] + ((num_blocks - 1) * block_size + nfft,))
+    for iblock in range(num_blocks):
+        start = iblock * block_size
+        total[..., start : start + nfft] += outputs[..., iblock, :]
+
+    return total[..., :length]
+
+
+def make_lti_callable(
+    path_dsp: Path,
+    block_size: int = 1 << 14,
+    parameters: Iterable[str] = PARAMETERS,
+) -> Callable:
+    """
+    Create a function with the interface of `wrapdsp.make_callable` for the
+    `ToneStack` which renders through `impulse_response` and `fft_convolve`.
+    The buffer can hold several signals, rendered with the same knobs.
+    Positional `values` are in the order of `parameters`.
+    """
+    parameters = list(parameters)
+
+    def py_lti(fs: int, buffer: np.ndarray, values: np.ndarray = None, **kwargs):
+        if values is not None:
+            kwargs = dict(zip(parameters, values))
+        # the compiled class gets float32 values, which also key the cache
+        kwargs = {p: np.float32(v) for p, v in kwargs.items()}
+        knobs = cabinet.absolute_values(path_dsp, kwargs, class_name="ToneStack")
+        ir = impulse_response(fs, **{p: float(knobs[p][0]) for p in PARAMETERS})
+        buffer = np.atleast_2d(np.asarray(buffer, dtype="float64"))
+        return fft_convolve(buffer, ir, block_size).astype("float32")
+
+    py_lti.parameters = parameters
+
+    return py_lti
+
+
+def with_lti(func: Callable, path_dsp: Path, block_size: int = 1 << 14) -> Callable:
+    """
+    Attach the LTI render of `make_lti_callable` to the compiled `ToneStack`
+    made by `wrapdsp.make_callable`, as its `lti` attribute. Passing
+    `lti=True` to `utils.fit_sim_data` or `render.render_chunked` then
+    renders through it instead of the compiled class.
+
+    Returns:
+        `func`
+    """
+    func.lti = make_lti_callable(path_dsp, block_size, func.parameters)
+    return func
+
+
+def verify_compiled(
+    func: Callable,
+    fs: int,
+    path_dsp: Path,
+    offsets: cabinet.Values,
+    length: int = 1 << 16,
+    seed: int = 0,
+) -> float:
+    """
+    Compare the LTI render with that of the compiled class made by
+    `wrapdsp.make_callable`, on white noise.
+
+    Returns:
+        the largest deviation relative to the peak of the compiled output
+    """
+    noise = np.random.default_rng(seed).uniform(-0.5, 0.5, length).astype("float32")
+    kwargs, rendered = cabinet.render_compiled(func, fs, offsets, noise)
+    lti = make_lti_callable(path_dsp)(fs, noise, **kwargs)[0].astype("float64")
+    return float(np.max(np.abs(rendered - lti)) / np.max(np.abs(rendered)))
@@ -16,13 +16,19 @@
 
 import json
 import math
+import os
+import pickle
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Callable, Iterable, Mapping, NamedTuple
+from typing import Callable, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
 
 import matplotlib as mpl
 import numpy as np
 import scipy as sp
 import scipy.optimize
+import scipy.signal
 
 mpl.use("Agg")
 from matplotlib import pyplot as plt
@@ -58,6 +64,43 @@ def wave_to_numpy(path: str, max_length: float = None) -> (np.ndarray, int):
     return values, rate
 
 
+def pcm_to_numpy(frames: bytes, num_channels: int, sampwidth: int) -> np.ndarray:
+    """
+    Mono float32 signal from the PCM frames of a wave file, scaled as
+    `wave_to_numpy`. Unsigned 8 bit samples are centered on zero.
+
+    Args:
+        frames: interleaved little endian frames, e.g. from `wave.readframes`
+        num_channels: number of channels, which are averaged
+        sampwidth: bytes per sample
+    """
+    raw = np.frombuffer(frames, dtype="u1")
+    if sampwidth == 1:
+        data = raw.astype("<i4") - 128
+    elif sampwidth == 3:
+        # sign extend the 24 bit samples from the top of 32 bit ones
+        padded = np.zeros((len(raw) // 3, 4), dtype="u1")
+        padded[:, 1:] = raw.reshape(-1, 3)
+        data = padded.view("<i4")[:, 0] >> 8
+    else:
+        data = np.frombuffer(frames, dtype=f"<i{sampwidth}")
+    values = np.mean(data.reshape(-1, num_channels), axis=1)
+    values = values / float(2 ** (sampwidth * 8))
+    return np.ascontiguousarray(values, dtype="float32")
+
+
+def numpy_to_pcm(signal: np.ndarray, sampwidth: int) -> bytes:
+    """PCM frames of a mono signal, the inverse of `pcm_to_numpy`."""
+    scale = 2 ** (sampwidth * 8)
+    ints = np.round(np.asarray(signal, dtype="float64") * scale)
+    ints = np.clip(ints, -(scale // 2), scale // 2 - 1).astype("<i4")
+    if sampwidth == 1:
+        return (ints + 128).astype("u1").tobytes()
+    if sampwidth == 3:
+        return ints.view("u1").reshape(-1, 4)[:, :3].tobytes()
+    return ints.astype(f"<i{sampwidth}").tobytes()
+
+
 def calc_fft(
     signal: Iterable[float],
     fs: float,
@@ -157,6 +200,87 @@ def plot_result(
         plt.close(fig)
 
 
+class FitCheckpoint:
+    """
+    The evaluations of a fit, saved to `path` every `interval` seconds and
+    at the start of each optimization method.
+
+    The history of evaluations doubles as a loss cache. A resumed fit
+    restarts the interrupted method from its start point and, the methods
+    being deterministic, retraces the earlier evaluations from the cache
+    before it continues where it stopped.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        fit_pars: Iterable[str],
+        interval: float = 60.0,
+        resume: bool = False,
+    ):
+        self.path = Path(path)
+        self.fit_pars = list(fit_pars)
+        self.interval = interval
+        self.method_index = 0
+        self.x0 = None
+        self.history = list()
+        self.cache = dict()
+        self.last_save = time.perf_counter()
+
+        if resume and self.path.exists():
+            self.load()
+
+    @property
+    def best(self) -> Tuple[np.ndarray, float]:
+        x, loss = min(self.history, key=lambda h: h[1])
+        return np.array(x), loss
+
+    def lookup(self, x: np.ndarray) -> Optional[float]:
+        return self.cache.get(tuple(np.asarray(x, dtype="float64").tolist()))
+
+    def record(self, x: np.ndarray, loss: float):
+        key = tuple(np.asarray(x, dtype="float64").tolist())
+        self.cache[key] = float(loss)
+        self.history.append((key, float(loss)))
+        if time.perf_counter() - self.last_save > self.interval:
+            self.save()
+
+    def start_method(self, method_index: int, x0: np.ndarray):
+        self.method_index = method_index
+        self.x0 = np.array(x0, dtype="float64")
+        self.save()
+
+    def save(self):
+        state = {
+            "fit_pars": self.fit_pars,
+            "method_index": self.method_index,
+            "x0": self.x0,
+            "history": self.history,
+        }
+        # replace the previous checkpoint only once the new one is complete
+        path_tmp = self.path.with_name(self.path.name + ".tmp")
+        with path_tmp.open("wb") as fio:
+            pickle.dump(state, fio)
+        os.replace(path_tmp, self.path)
+        self.last_save = time.perf_counter()
+
+    def load(self):
+        with self.path.open("rb") as fio:
+            state = pickle.load(fio)
+        if state["fit_pars"] != self.fit_pars:
+            raise ValueError(
+                f"checkpoint {self.path} fits {state['fit_pars']}, not {self.fit_pars}"
+            )
+        self.method_index = state["method_index"]
+        self.x0 = state["x0"]
+        self.history = state["history"]
+        self.cache = dict(self.history)
+        print(
+            f"resuming method {self.method_index} "
+            f"with {len(self.history)} cached evaluations"
+        )
+
+
 def fit_sim_data(
     datas: Iterable[FitData],
     model_func: Callable,
@@ -165,48 +289,459 @@ def fit_sim_data(
     fix_pars: Iterable[str],
     methods: Iterable[str] = ["Powell"],
     randomness: float = 0,
+    loss: Callable = None,
+    checkpoint: Path = None,
+    checkpoint_interval: float = 60.0,
+    resume: bool = False,
+    diff_step: float = 1e-3,
+    num_workers: int = None,
+    lti: bool = False,
 ):
+    if lti:
+        # the render of a linear model attached by e.g. `tonestack.with_lti`
+        if not hasattr(model_func, "lti"):
+            raise ValueError("model_func has no LTI render, see tonestack.with_lti")
+        model_func = model_func.lti
+
     fix_pars = set(fix_pars)
     fit_pars = [p for p in parameters if p not in fix_pars]
 
     par_values = {p: v for p, v in zip(parameters, values)}
 
-    def fun(x):
+    def fit_kwargs(x):
         kwargs = dict(par_values)
         # copy the fit values into the dict of parameters
         for par, val in zip(fit_pars, x):
             kwargs[par] = val
+        return kwargs
+
+    def data_err(data, kwargs):
+        pred = model_func(data.fs, data.signal_in, **kwargs)[0]
+        err_scale = (
+            np.max(data.signal_out[data.mask]) - np.min(data.signal_out[data.mask])
+        ) ** 2
+        return np.mean((pred[data.mask] - data.signal_out[data.mask]) ** 2) / (
+            err_scale + 1e-12
+        )
+
+    def fun(x):
+        kwargs = fit_kwargs(x)
+
+        # a loss which doesn't render, e.g. `cabinet.make_response_loss`
+        if loss is not None:
+            return float(loss(kwargs))
 
         err = 0
         for data in datas:
-            pred = model_func(data.fs, data.signal_in, **kwargs)[0]
-            err_scale = (
-                np.max(data.signal_out[data.mask]) - np.min(data.signal_out[data.mask])
-            ) ** 2
-            err += np.mean((pred[data.mask] - data.signal_out[data.mask]) ** 2) / (
-                err_scale + 1e-12
+            err += data_err(data, kwargs)
+
+        return float(err * 1e3)
+
+    # the residuals are weighted such that their sum of squares is `fun`
+    datas = list(datas)
+    weights = [
+        np.sqrt(
+            1e3
+            / np.count_nonzero(d.mask)
+            / (
+                (np.max(d.signal_out[d.mask]) - np.min(d.signal_out[d.mask])) ** 2
+                + 1e-12
             )
-
-        return err * 1e3
-
-    x0 = list(values)
+        )
+        for d in datas
+    ]
+
+    def residuals(x):
+        kwargs = fit_kwargs(x)
+        res = list()
+        for data, weight in zip(datas, weights):
+            pred = model_func(data.fs, data.signal_in, **kwargs)[0]
+            diff = pred[data.mask] - data.signal_out[data.mask]
+            res.append(diff.astype("float64") * weight)
+        return np.concatenate(res)
+
+    # the error of each dataset at the last complete evaluation, the largest
+    # contributions are evaluated first such that a bound is crossed early
+    contributions = np.zeros(len(datas))
+
+    def bounded_fun(x, bound):
+        kwargs = fit_kwargs(x)
+        errs = np.zeros(len(datas))
+        for idata in np.argsort(-contributions, kind="stable"):
+            errs[idata] = data_err(datas[idata], kwargs) * 1e3
+            if np.sum(errs) > bound:
+                return np.sum(errs), False
+        contributions[:] = errs
+        return np.sum(errs), True
+
+    x0 = np.array([par_values[p] for p in fit_pars], dtype="float64")
+
+    ckpt = None
+    start_fit = 0
+    resumed = False
+    if checkpoint is not None:
+        ckpt = FitCheckpoint(checkpoint, fit_pars, checkpoint_interval, resume)
+        if ckpt.x0 is not None:
+            resumed = True
+            start_fit = ckpt.method_index
+            x0 = ckpt.x0 if start_fit < len(methods) else ckpt.best[0]
+
+        def cached_fun(x):
+            err = ckpt.lookup(x)
+            if err is None:
+                err = fun(x)
+                ckpt.record(x, err)
+            return err
+
+        def cached_bounded_fun(x, bound):
+            err = ckpt.lookup(x)
+            if err is not None:
+                return err, True
+            err, exact = bounded_fun(x, bound)
+            if exact:
+                ckpt.record(x, err)
+            return err, exact
+
+    else:
+        cached_fun = fun
+        cached_bounded_fun = bounded_fun
 
     num_fits = len(methods)
     for ifit, method in enumerate(methods):
-        if num_fits >= 1 and randomness > 0:
+        if ifit < start_fit:
+            continue
+        # a resumed method starts from its saved start point
+        if num_fits >= 1 and randomness > 0 and not (resumed and ifit == start_fit):
             random_factor = randomness * (num_fits - ifit - 1) / (num_fits - 1)
             x0 += np.random.randn(len(x0)) * random_factor
-        res = sp.optimize.minimize(fun=fun, x0=x0, method=method)
+        if ckpt is not None:
+            ckpt.start_method(ifit, x0)
+        if method == "bounded":
+            if loss is not None:
+                raise ValueError("the bounded method renders the datasets")
+            res = minimize_bounded(cached_bounded_fun, x0, seed=ifit)
+            print(f"early exits: {res.num_bounded} of {res.nfev} evaluations")
+        elif method == "least_squares":
+            if loss is not None:
+                raise ValueError("least squares needs the residuals of the renders")
+            res = fit_least_squares(
+                residuals, x0, ckpt, diff_step=diff_step, num_workers=num_workers
+            )
+        elif method == "L-BFGS-B":
+            # the gradient evaluations go around the checkpoint, they run in
+            # parallel and are cheap to redo
+            def fun_and_gradient(x):
+                err = cached_fun(x)
+                grad = finite_difference_jacobian(fun, x, err, diff_step, num_workers)
+                return err, grad
+
+            res = sp.optimize.minimize(
+                fun=fun_and_gradient, x0=x0, method=method, jac=True
+            )
+        else:
+            res = sp.optimize.minimize(fun=cached_fun, x0=x0, method=method)
         print(f"loss: {res.fun:+.4e}")
         x0 = res.x
 
+    if ckpt is not None:
+        ckpt.start_method(num_fits, x0)
+
     kwargs = dict(par_values)
-    for par, val in zip(fit_pars, res.x):
+    for par, val in zip(fit_pars, x0):
         kwargs[par] = float(val)
 
     return kwargs
 
 
+def finite_difference_jacobian(
+    func: Callable,
+    x: np.ndarray,
+    f0: np.ndarray,
+    step: float = 1e-3,
+    num_workers: int = None,
+) -> np.ndarray:
+    """
+    Forward difference Jacobian of `func` at `x`, evaluating the perturbed
+    parameter sets concurrently. The renders release the GIL, so threads
+    run them in parallel.
+
+    Args:
+        func: scalar or vector function of the parameters
+        x: parameters at which to differentiate
+        f0: `func(x)`, reused for every column
+        step: perturbation relative to the magnitude of each parameter, at
+            least this much in absolute terms
+        num_workers: number of concurrent evaluations
+
+    Returns:
+        the derivatives, of shape `(*f0.shape, len(x))`
+    """
+    x = np.asarray(x, dtype="float64")
+    f0 = np.asarray(f0, dtype="float64")
+    steps = step * np.maximum(1.0, np.abs(x))
+
+    def column(i):
+        xi = x.copy()
+        xi[i] += steps[i]
+        return (np.asarray(func(xi), dtype="float64") - f0) / steps[i]
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        columns = list(pool.map(column, range(len(x))))
+
+    return np.stack(columns, axis=-1)
+
+
+def fit_least_squares(
+    residuals: Callable,
+    x0: np.ndarray,
+    ckpt: FitCheckpoint = None,
+    diff_step: float = 1e-3,
+    num_workers: int = None,
+) -> sp.optimize.OptimizeResult:
+    """
+    Minimize the sum of squared residuals with the trust region reflective
+    method, with a `finite_difference_jacobian` evaluated in parallel.
+
+    The loss of each residual evaluation is recorded in the checkpoint, if
+    given, but the residuals themselves aren't kept so a resumed fit renders
+    them again.
+
+    Returns:
+        the result, with the loss in `fun` as for the other methods
+    """
+    # `least_squares` asks for the jacobian at the point it last evaluated
+    last = dict()
+
+    def fun(x):
+        last["x"] = np.array(x)
+        last["r"] = residuals(x)
+        if ckpt is not None:
+            ckpt.record(x, float(np.sum(last["r"] ** 2)))
+        return last["r"]
+
+    def jac(x):
+        r0 = last["r"] if np.array_equal(last.get("x"), x) else residuals(x)
+        return finite_difference_jacobian(residuals, x, r0, diff_step, num_workers)
+
+    res = sp.optimize.least_squares(fun, x0, jac=jac, method="trf")
+    print(f"least squares: {res.nfev} evaluations, {res.njev} jacobians")
+    return sp.optimize.OptimizeResult(
+        x=res.x, fun=float(np.sum(res.fun**2)), nfev=res.nfev, njev=res.njev
+    )
+
+
+def minimize_bounded(
+    fun: Callable,
+    x0: Iterable[float],
+    step: float = 0.1,
+    popsize: int = 8,
+    maxiter: int = 100,
+    seed: int = None,
+) -> sp.optimize.OptimizeResult:
+    """
+    Minimize with a (1+lambda) evolution strategy, an optimizer which only
+    needs to know if a candidate improves on the best point. Each candidate
+    is evaluated with the best loss as a bound, past which the evaluation can
+    stop early.
+
+    Args:
+        fun: called as `fun(x, bound)`, returns the loss and whether it is
+            exact, or only a lower bound because it exceeded `bound`
+        x0: initial point
+        step: initial standard deviation of the candidates about the best
+            point, adapted by the 1/5th success rule
+        popsize: number of candidates per iteration
+        maxiter: number of iterations
+        seed: seed of the candidate sampling
+
+    Returns:
+        the result, with the number of early exits in `num_bounded`
+    """
+    rng = np.random.default_rng(seed)
+    x_best = np.array(x0, dtype="float64")
+    f_best, _ = fun(x_best, np.inf)
+    num_bounded = 0
+
+    for _ in range(maxiter):
+        num_success = 0
+        for _ in range(popsize):
+            x = x_best + step * rng.standard_normal(len(x_best))
+            f, exact = fun(x, f_best)
+            if not exact:
+                num_bounded += 1
+            elif f < f_best:
+                x_best, f_best = x, f
+                num_success += 1
+        step *= np.exp((num_success / popsize - 0.2) / 0.8)
+
+    return sp.optimize.OptimizeResult(
+        x=x_best,
+        fun=f_best,
+        nit=maxiter,
+        nfev=maxiter * popsize + 1,
+        num_bounded=num_bounded,
+    )
+
+
+class FitStage(NamedTuple):
+    """
+    A fidelity level of `fit_staged`. The defaults leave the data unchanged.
+
+    Attributes:
+        max_length: fit only the first this many seconds of each dataset
+        decimate: fit the datasets down-sampled by this factor, the model
+            then renders at the reduced rate and its filter corners above the
+            reduced Nyquist frequency are misplaced or unstable (see the
+            `max_corner` of `fit_staged`)
+        num_datas: fit only this many datasets, evenly spread over the list
+        methods: optimization methods of the stage
+    """
+
+    max_length: float = None
+    decimate: int = 1
+    num_datas: int = None
+    methods: Tuple[str, ...] = ("Powell",)
+
+
+def reduce_fit_data(datas: Iterable[FitData], stage: FitStage) -> List[FitData]:
+    """
+    Reduce the datasets to the fidelity of a `FitStage`.
+    """
+    datas = list(datas)
+    if stage.num_datas is not None and stage.num_datas < len(datas):
+        step = len(datas) / stage.num_datas
+        datas = [datas[int(i * step)] for i in range(stage.num_datas)]
+
+    reduced = list()
+    for data in datas:
+        num = len(data.signal_in)
+        if stage.max_length is not None:
+            num = min(num, math.ceil(stage.max_length * data.fs))
+
+        signal_in = data.signal_in[:num]
+        signal_out = data.signal_out[:num]
+        times = data.time[:num]
+        mask = data.mask[:num]
+        fs = data.fs
+
+        if stage.decimate > 1:
+            # filter both signals alike so the model sees the target band
+            signal_in = sp.signal.decimate(signal_in, stage.decimate)
+            signal_out = sp.signal.decimate(signal_out, stage.decimate)
+            times = times[:: stage.decimate]
+            mask = mask[:: stage.decimate]
+            fs = fs // stage.decimate
+
+        reduced.append(
+            FitData(
+                fs=fs,
+                time=times,
+                signal_in=np.ascontiguousarray(signal_in, dtype="float32"),
+                signal_out=signal_out,
+                mask=mask,
+                name=data.name,
+            )
+        )
+
+    return reduced
+
+
+def fit_staged(
+    datas: Iterable[FitData],
+    model_func: Callable,
+    parameters: Iterable[str],
+    values: Iterable[float],
+    fix_pars: Iterable[str],
+    stages: Iterable[FitStage],
+    max_corner: float = None,
+    checkpoint: Path = None,
+    resume: bool = False,
+    **kwargs,
+) -> Tuple[Dict[str, float], List[float]]:
+    """
+    Fit with `fit_sim_data` through a sequence of fidelity levels, typically
+    from short, decimated excerpts of a few datasets to the full data. The
+    best parameters of each stage start the next, such that most evaluations
+    render a fraction of the samples.
+
+    Args:
+        stages: the fidelity levels, a final full-data stage is added if the
+            last one reduces the data
+        max_corner: highest filter corner of the model (Hz), a stage which
+            decimates the data such that its Nyquist frequency is below it
+            raises a warning
+        checkpoint: each stage is checkpointed to this path with the suffix
+            `.stage<index>`, such that the fidelities don't share a loss
+            cache
+        resume: resume from the stage checkpoints, skipping the stages
+            which completed
+        kwargs: passed to `fit_sim_data`
+
+    Returns:
+        the fit parameters and the wall time of each stage (s)
+    """
+    datas = list(datas)
+    parameters = list(parameters)
+    stages = list(stages)
+    if not stages or stages[-1][:3] != FitStage()[:3]:
+        stages.append(FitStage(methods=stages[-1].methods if stages else ("Powell",)))
+
+    for istage, stage in enumerate(stages):
+        nyquist = min((d.fs for d in datas), default=0) / stage.decimate / 2
+        if max_corner is not None and stage.decimate > 1 and max_corner >= nyquist:
+            warnings.warn(
+                f"stage {istage} decimates to a Nyquist frequency of "
+                f"{nyquist:.0f} Hz, below the model corner at {max_corner:.0f} Hz"
+            )
+
+    fix_pars = set(fix_pars)
+    fit_pars = [p for p in parameters if p not in fix_pars]
+
+    seconds = list()
+    for istage, stage in enumerate(stages):
+        start = time.perf_counter()
+        stage_checkpoint = None
+        if checkpoint is not None:
+            stage_checkpoint = Path(checkpoint)
+            stage_checkpoint = stage_checkpoint.with_name(
+                f"{stage_checkpoint.name}.stage{istage}"
+            )
+
+        if resume and stage_checkpoint is not None and stage_checkpoint.exists():
+            ckpt = FitCheckpoint(stage_checkpoint, fit_pars, resume=True)
+            # the end point of a completed stage is saved as the start point
+            # of the method after the last
+            if ckpt.method_index >= len(stage.methods):
+                fit = dict(zip(parameters, values))
+                fit.update(zip(fit_pars, map(float, ckpt.x0)))
+                values = [fit[p] for p in parameters]
+                seconds.append(time.perf_counter() - start)
+                print(f"stage {istage}: completed in {stage_checkpoint}")
+                continue
+
+        stage_datas = reduce_fit_data(datas, stage)
+        fit = fit_sim_data(
+            stage_datas,
+            model_func,
+            parameters,
+            values,
+            fix_pars,
+            methods=stage.methods,
+            checkpoint=stage_checkpoint,
+            resume=resume,
+            **kwargs,
+        )
+        values = [fit[p] for p in parameters]
+        seconds.append(time.perf_counter() - start)
+        print(
+            f"stage {istage}: {len(stage_datas)} datas, "
+            f"{sum(len(d.signal_in) for d in stage_datas)} samples, "
+            f"{seconds[-1]:.2f} s"
+        )
+
+    return fit, seconds
+
+
 def update_defaults(path_dsp: Path, class_name: str, kwargs, ignore={}):
     with (path_dsp / f"{class_name}.json").open("r") as fio:
         pars_info = json.load(fio)
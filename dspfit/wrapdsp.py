@@ -19,51 +19,520 @@ Functionality to compile faust code and expose it to python.
 """
 
 import ctypes
+import hashlib
 import json
+import multiprocessing
 import os
 import re
+import shutil
 import subprocess
+import time
 import warnings
 from contextlib import contextmanager
 from pathlib import Path
-from typing import Iterable, Mapping, Tuple
+from typing import Dict, Iterable, List, Mapping, Tuple, Union
 
 import numpy as np
 
 _WRAP_CODE = """
 {header}
 
+#include <algorithm>
+#include <atomic>
+#include <cstdint>
+#include <vector>
+#if defined(__SSE__)
+#include <xmmintrin.h>
+#endif
+
+namespace {{
+
+using Setter = void (*)({name}&, FAUSTFLOAT);
+
+// the parameter table, parameter values are passed as arrays in this order
+const int numParameters = {num_parameters};
+const char* const parameterNames[] = {{{parameter_names}nullptr}};
+const Setter parameterSetters[] = {{{parameter_setters}nullptr}};
+
+void setParameters({name}& dsp, const FAUSTFLOAT* values, int n) {{
+  n = std::min(n, numParameters);
+  for (int i = 0; i < n; i++) parameterSetters[i](dsp, values[i]);
+}}
+
+// whether the compute paths flush denormals to zero, see `set_flush_denormals`
+std::atomic<bool> flushDenormals{{false}};
+
+// Sets the flush-to-zero and denormals-are-zero modes of the calling thread
+// while in scope, if enabled, and restores the previous modes on exit.
+class DenormalGuard {{
+public:
+  DenormalGuard() {{
+    if (!flushDenormals) return;
+#if defined(__SSE__)
+    saved = _mm_getcsr();
+    _mm_setcsr(saved | 0x8040);
+    active = true;
+#elif defined(__aarch64__)
+    asm volatile("mrs %0, fpcr" : "=r"(saved));
+    asm volatile("msr fpcr, %0" : : "r"(saved | (uint64_t(1) << 24)));
+    active = true;
+#endif
+  }}
+
+  ~DenormalGuard() {{
+    if (!active) return;
+#if defined(__SSE__)
+    _mm_setcsr(saved);
+#elif defined(__aarch64__)
+    asm volatile("msr fpcr, %0" : : "r"(saved));
+#endif
+  }}
+
+private:
+  bool active = false;
+#if defined(__SSE__)
+  unsigned int saved = 0;
+#else
+  uint64_t saved = 0;
+#endif
+}};
+
+struct Handle {{
+  {name} dsp;
+  // the sampling rate the instance was prepared for
+  int samplingFreq = 0;
+}};
+
+}}
+
 extern "C" {{
 
-void compute(int samplingFreq, int count, FAUSTFLOAT** buffer{arguments}) {{
+int num_params() {{ return numParameters; }}
+
+const char* param_name(int index) {{
+  return (index >= 0 && index < numParameters) ? parameterNames[index] : nullptr;
+}}
+
+void* create(int samplingFreq) {{
+  Handle* handle = new Handle();
+  handle->dsp.prepare(samplingFreq);
+  handle->samplingFreq = samplingFreq;
+  return handle;
+}}
+
+void destroy(void* handle) {{ delete static_cast<Handle*>(handle); }}
+
+void set_flush_denormals(int enabled) {{ flushDenormals = enabled != 0; }}
+
+int get_flush_denormals() {{ return flushDenormals ? 1 : 0; }}
+
+void set_params(void* handle, const FAUSTFLOAT* values, int n) {{
+  setParameters(static_cast<Handle*>(handle)->dsp, values, n);
+}}
+
+void process(void* handle, int count, FAUSTFLOAT** buffer) {{
+  DenormalGuard guard;
+  static_cast<Handle*>(handle)->dsp.process(count, buffer);
+}}
+
+void compute(int samplingFreq, int count, FAUSTFLOAT** buffer, const FAUSTFLOAT* values, int n) {{
+  DenormalGuard guard;
+  {name} dsp = {name}();
+  dsp.prepare(samplingFreq);
+  setParameters(dsp, values, n);
+  dsp.process(count, buffer);
+}}
+
+void compute_automated(int samplingFreq, int count, FAUSTFLOAT** buffer, const FAUSTFLOAT* trajectories, int n, int blockSize) {{
+  DenormalGuard guard;
+  {name} dsp = {name}();
+  dsp.prepare(samplingFreq);
+  FAUSTFLOAT* block[2];
+  for (int start = 0, iblock = 0; start < count; start += blockSize, iblock++) {{
+    const int size = std::min(blockSize, count - start);
+    setParameters(dsp, trajectories + iblock * n, n);
+    for (int c = 0; c < 2; c++) block[c] = buffer[c] ? buffer[c] + start : nullptr;
+    dsp.process(size, block);
+  }}
+}}
+
+void compute_level(int samplingFreq, int count, const FAUSTFLOAT* input, int blockSize, double* moments, const FAUSTFLOAT* values, int n) {{
+  DenormalGuard guard;
+  {name} dsp = {name}();
+  dsp.prepare(samplingFreq);
+  setParameters(dsp, values, n);
+  std::vector<FAUSTFLOAT> scratch(blockSize);
+  FAUSTFLOAT* buffer[2] = {{scratch.data(), nullptr}};
+  double sum = 0;
+  double sum2 = 0;
+  for (int start = 0; start < count; start += blockSize) {{
+    const int size = std::min(blockSize, count - start);
+    std::copy(input + start, input + start + size, scratch.data());
+    dsp.process(size, buffer);
+    for (int i = 0; i < size; i++) {{
+      sum += scratch[i];
+      sum2 += double(scratch[i]) * scratch[i];
+    }}
+  }}
+  moments[0] = sum;
+  moments[1] = sum2;
+}}
+{monitor}{state}
+}}
+"""
+
+_CHAIN_CODE = """
+#include <algorithm>
+
+{includes}
+
+class {name} {{
+public:
+  void prepare(int sampleRate) {{
+    {prepare}
+  }}
+
+  void process(int count, FAUSTFLOAT** buffer) {{
+    // each block goes through all the stages while it is in cache
+    FAUSTFLOAT* block[2] = {{nullptr, nullptr}};
+    for (int start = 0; start < count; start += blockSize) {{
+      const int size = std::min(blockSize, count - start);
+      block[0] = buffer[0] + start;
+      {process}
+    }}
+  }}
+
+  {setters}
+
+private:
+  static constexpr int blockSize = {block_size};
+  {members}
+}};
+"""
+
+_MONITOR_CODE = """
+void compute_monitor(int samplingFreq, int count, FAUSTFLOAT** buffer, FAUSTFLOAT** taps, const FAUSTFLOAT* values, int n) {{
+  DenormalGuard guard;
   {name} dsp = {name}();
   dsp.prepare(samplingFreq);
-  {set_parameters}
+  setParameters(dsp, values, n);
+  {set_taps}
   dsp.process(count, buffer);
+  {unset_taps}
+}}
+"""
+
+# name of the thread local pointer through which a monitored faust class
+# writes its taps
+_MONITOR_TAPS = "dspfit_{class_name}_taps"
+
+_STATE_CODE = """
+// the state starts with the sampling rate it was saved at
+int state_size() {{ return int(sizeof(int)) + {class_name}Faust::dspfitStateSize(); }}
+
+int save_state(void* handle, char* state) {{
+  Handle* h = static_cast<Handle*>(handle);
+  {class_name}Faust* faust = h->dsp.dspfitFaust();
+  if (!faust) return -1;
+  std::memcpy(state, &h->samplingFreq, sizeof(int));
+  faust->dspfitSaveState(state + sizeof(int));
+  return 0;
 }}
 
+int load_state(void* handle, const char* state) {{
+  Handle* h = static_cast<Handle*>(handle);
+  {class_name}Faust* faust = h->dsp.dspfitFaust();
+  if (!faust) return -1;
+  int samplingFreq = 0;
+  std::memcpy(&samplingFreq, state, sizeof(int));
+  if (samplingFreq != h->samplingFreq) return -2;
+  faust->dspfitLoadState(state + sizeof(int));
+  return 0;
+}}
+
+int compute_from_state(int samplingFreq, int count, FAUSTFLOAT** buffer, const FAUSTFLOAT* values, int n, const char* state) {{
+  DenormalGuard guard;
+  Handle* handle = static_cast<Handle*>(create(samplingFreq));
+  setParameters(handle->dsp, values, n);
+  const int status = load_state(handle, state);
+  if (status == 0) handle->dsp.process(count, buffer);
+  destroy(handle);
+  return status;
 }}
 """
 
+# faust members which carry the dsp state from one sample to the next
+_STATE_MEMBER = re.compile(
+    r"^\s+(?:float|double|int|FAUSTFLOAT)\s+"
+    r"([fi](?:Rec|Vec|Yec)\d+(?:_perm)?|IOTA\d*)\s*(?:\[\d+\])?;",
+    flags=re.MULTILINE,
+)
+
+# faust compiler options of the named code generation modes, see
+# `faust_codegen`
+CODEGEN_MODES = {
+    "scalar": [],
+    "vec16": ["-vec", "-vs", "16"],
+    "vec32": ["-vec", "-vs", "32"],
+    "vec64": ["-vec", "-vs", "64"],
+    "vec32-lv1": ["-vec", "-lv", "1", "-vs", "32"],
+    "vec32-dfs": ["-vec", "-dfs", "-vs", "32"],
+}
+
+# the faust options recorded in a generated header, and those of them which
+# `faust_codegen` sets itself, with their number of values
+_FAUST_OPTIONS = re.compile(r"^Compilation options: (.*)$", flags=re.MULTILINE)
+_FAUST_OWN_OPTIONS = {"-lang": 1, "-cn": 1, "-a": 1, "-o": 1, "-I": 1}
+
+# compiler optimization flags of the named build profiles, the "pgo" profile
+# is additionally trained on some renders, see `compile_pgo`
+BUILD_PROFILES = {
+    "baseline": "-O3",
+    "native": "-O3 -march=native",
+    # the value changing optimizations of -ffast-math, except those assuming
+    # finite math and those changing the rounding of denormals
+    "fastmath": (
+        "-O3 -fno-math-errno -fno-trapping-math -fno-signed-zeros "
+        "-fassociative-math -freciprocal-math"
+    ),
+    "pgo": "-O3",
+}
+
+# name of the precompiled header holding the code common to all the wrapped
+# classes, see `precompile_headers`
+_PCH_NAME = "dspfit_common.h"
+
+# standard headers used by the wrapper code
+_PCH_INCLUDES = ("<algorithm>", "<atomic>", "<cstdint>", "<cstring>", "<vector>")
+
+_INCLUDE = re.compile(r'^\s*#\s*include\s*(<[^>]+>|"[^"]+")', flags=re.MULTILINE)
 
-def wrap_compute(code: str, class_name: str, parameters: Iterable[str]):
-    """Generate code which initializes a DSP instance and calls its compute."""
+_FLOAT_P = ctypes.POINTER(ctypes.c_float)
+_BUFFER = _FLOAT_P * 2
 
-    arguments = ", ".join([f"FAUSTFLOAT {n}" for n in parameters])
-    arguments = ", " + arguments if arguments else ""
 
-    set_parameters = "\n  ".join([f"dsp.set_{n}({n});" for n in parameters])
+def wrap_compute(
+    code: str,
+    class_name: str,
+    parameters: Iterable[str],
+    monitors: Mapping[str, int] = None,
+    state: bool = False,
+):
+    """
+    Generate code which initializes a DSP instance and calls its compute.
+
+    The parameters are exposed through a table in the library (see
+    `DspLibrary`) and their values are passed as a single array, so the
+    exported signatures don't depend on the parameters.
+
+    Args:
+        code: the header code declaring the class
+        class_name: name of the class to wrap
+        parameters: names of the parameters to expose, in order
+        monitors: number of taps for each faust class patched with
+            `monitor_faust_code`, to add a `compute_monitor` function
+        state: the faust class was patched with `state_faust_code`, add
+            functions to save and load the dsp state
+    """
+    parameters = list(parameters)
+
+    parameter_names = "".join([f'"{n}", ' for n in parameters])
+    parameter_setters = "".join(
+        [f"[]({class_name}& d, FAUSTFLOAT v) {{ d.set_{n}(v); }}, " for n in parameters]
+    )
+
+    monitor = ""
+    if monitors:
+        set_taps = list()
+        unset_taps = list()
+        offset = 0
+        for monitor_class, num_taps in monitors.items():
+            taps = _MONITOR_TAPS.format(class_name=monitor_class)
+            set_taps.append(f"{taps} = taps + {offset};")
+            unset_taps.append(f"{taps} = nullptr;")
+            offset += num_taps
+
+        monitor = _MONITOR_CODE.format(
+            name=class_name,
+            set_taps="\n  ".join(set_taps),
+            unset_taps="\n  ".join(unset_taps),
+        )
+
+    state_code = ""
+    if state:
+        state_code = _STATE_CODE.format(class_name=class_name)
 
     code = _WRAP_CODE.format(
         header=code,
         name=class_name,
-        arguments=arguments,
-        set_parameters=set_parameters,
+        num_parameters=len(parameters),
+        parameter_names=parameter_names,
+        parameter_setters=parameter_setters,
+        monitor=monitor,
+        state=state_code,
     )
 
     return code
 
 
+def monitor_faust_code(code: str, class_name: str, members: Iterable[str]) -> str:
+    """
+    Patch faust generated code such that each of `members` is written to a
+    tap channel at every sample of the compute loop.
+
+    A member can be the name of a faust state array (e.g. `fRec3`), in which
+    case its current value is tapped, or any expression valid at the end of
+    the compute loop (e.g. `fTemp2` or `output0[i]`).
+
+    The taps are written through a thread local pointer which is only set by
+    the wrapper's `compute_monitor`, so the patched class otherwise behaves as
+    the original.
+    """
+    taps = _MONITOR_TAPS.format(class_name=class_name)
+
+    lines = list()
+    for itap, member in enumerate(members):
+        if code.find(member) < 0:
+            raise RuntimeError(f"{member} not found in source")
+        if re.search(rf"\b{re.escape(member)}\[\d+\];", code):
+            member = f"{member}[0]"
+        lines.append(f"\t\t\t\t{taps}[{itap}][i] = {member};\n")
+
+    match = re.search(rf"^class {class_name}Faust\b", code, flags=re.MULTILINE)
+    if match is None:
+        raise RuntimeError(f"can't find class {class_name}Faust in source")
+    idx_class = match.start()
+
+    idx_insert = code.find("\tvirtual void compute(", idx_class)
+    idx_insert = code.find("\t\t}\n\t}\n", idx_insert)
+    if idx_insert < 0:
+        raise RuntimeError("can't find inspection insertion point")
+
+    code = "".join(
+        (
+            code[:idx_class],
+            f"static thread_local FAUSTFLOAT** {taps} = nullptr;\n\n",
+            code[idx_class:idx_insert],
+            f"\t\t\tif ({taps}) {{\n",
+            *lines,
+            "\t\t\t}\n",
+            code[idx_insert:],
+        )
+    )
+
+    return code
+
+
+def state_faust_code(code: str, class_name: str) -> str:
+    """
+    Patch faust generated code such that the state members of the class (the
+    `fRec*`, `fVec*`, `iRec*`, `iVec*` and `IOTA` members) can be copied to and
+    from a byte buffer. The faust2hpp class exposes its faust instance once
+    patched with `state_wrapper_code`.
+    """
+    match = re.search(rf"^class {class_name}Faust\b", code, flags=re.MULTILINE)
+    if match is None:
+        raise RuntimeError(f"can't find class {class_name}Faust in source")
+    idx_class = match.start()
+
+    idx_end = code.find("\n};", idx_class)
+    if idx_end < 0:
+        raise RuntimeError(f"can't find end of class {class_name}Faust")
+
+    members = _STATE_MEMBER.findall(code, idx_class, idx_end)
+
+    sizes = " + ".join([f"sizeof({m})" for m in members]) or "0"
+    save = "".join(
+        [
+            f"\t\tstd::memcpy(state, &{m}, sizeof({m}));\n"
+            f"\t\tstate += sizeof({m});\n"
+            for m in members
+        ]
+    )
+    load = "".join(
+        [
+            f"\t\tstd::memcpy(&{m}, state, sizeof({m}));\n"
+            f"\t\tstate += sizeof({m});\n"
+            for m in members
+        ]
+    )
+
+    code = "".join(
+        (
+            code[:idx_class],
+            "#include <cstring>\n\n",
+            code[idx_class:idx_end],
+            "\n\n public:\n\n",
+            f"\tstatic int dspfitStateSize() {{\n\t\treturn int({sizes});\n\t}}\n\n",
+            f"\tvoid dspfitSaveState(char* state) const {{\n{save}\t}}\n\n",
+            f"\tvoid dspfitLoadState(const char* state) {{\n{load}\t}}\n",
+            code[idx_end:],
+        )
+    )
+
+    return code
+
+
+def state_wrapper_code(code: str, class_name: str) -> str:
+    """
+    Patch the faust2hpp class such that it returns the faust instance it owns,
+    by value, pointer or unique pointer, from `dspfitFaust`.
+    """
+    match = re.search(
+        rf"^\s*(?:(std::unique_ptr<\s*{class_name}Faust\s*>)"
+        rf"|{class_name}Faust\s*(\*)?)\s*(\w+)\s*;",
+        code,
+        flags=re.MULTILINE,
+    )
+    if match is None:
+        raise RuntimeError(f"can't find the {class_name}Faust member of {class_name}")
+    unique, pointer, member = match.groups()
+    if unique:
+        instance = f"{member}.get()"
+    elif pointer:
+        instance = member
+    else:
+        instance = f"&{member}"
+
+    match = re.search(rf"^class {class_name}\b[^{{;]*\{{", code, flags=re.MULTILINE)
+    if match is None:
+        raise RuntimeError(f"can't find class {class_name} in source")
+    idx_open = match.end()
+
+    return "".join(
+        (
+            code[:idx_open],
+            "\n public:\n",
+            f"  {class_name}Faust* dspfitFaust() {{ return {instance}; }}\n\n",
+            " private:",
+            code[idx_open:],
+        )
+    )
+
+
+def _write_patched(
+    path_patched: Path,
+    path_headers: Path,
+    class_name: str,
+    faust_code: str,
+    wrapper_code: str = None,
+):
+    """
+    Write patched faust code for `class_name` to `path_patched`, along with a
+    copy of its wrapper so that its relative include resolves to the patched
+    code. The wrapper is replaced by `wrapper_code` if given. The headers in
+    `path_headers` are left untouched.
+    """
+    path_patched.mkdir(parents=True, exist_ok=True)
+    with (path_patched / f"{class_name}Faust.h").open("w") as fio:
+        fio.write(faust_code)
+    if wrapper_code is None:
+        with (path_headers / f"{class_name}.h").open("r") as fio:
+            wrapper_code = fio.read()
+    with (path_patched / f"{class_name}.h").open("w") as fio:
+        fio.write(wrapper_code)
+
+
 @contextmanager
 def scoped_file(path: Path):
     yield
@@ -73,61 +542,615 @@ def scoped_file(path: Path):
         pass
 
 
-def compile_wrapped(class_name: str, path_build: Path, path_headers: Path, code: str):
-    """Copile warpped faust code into a dll"""
+def precompile_headers(path_build: Path, path_headers: Path, flags: str) -> Path:
+    """
+    Precompile the headers which are common to all the wrapped classes: the
+    standard headers and the faust architecture headers included by the
+    generated headers, but not the class headers themselves.
+
+    The precompiled header depends on its content, on the contents of the
+    headers in `path_headers` other than the class headers, and on the
+    compiler flags. It is reused by any later build with the same ones.
+
+    Returns:
+        the directory containing the precompiled header
+    """
+    class_headers = {p.name for p in path_headers.glob("*Faust.h")}
+    class_headers |= {f"{n[:-len('Faust.h')]}.h" for n in class_headers}
+
+    includes = dict.fromkeys(_PCH_INCLUDES)
+    for path in sorted(path_headers.glob("*.h")):
+        with path.open("r") as fio:
+            for include in _INCLUDE.findall(fio.read()):
+                if include.startswith('"') and (
+                    include[1:-1] in class_headers
+                    or not (path_headers / include[1:-1]).is_file()
+                ):
+                    continue
+                includes[include] = None
+
+    code = "".join([f"#include {i}\n" for i in includes])
+    digest = hashlib.sha1((flags + code).encode("utf8"))
+    for path in sorted(path_headers.rglob("*")):
+        if path.is_file() and path.name not in class_headers:
+            digest.update(str(path.relative_to(path_headers)).encode("utf8"))
+            digest.update(path.read_bytes())
+    key = digest.hexdigest()[:12]
+
+    path_pch = path_build / "pch" / key
+    if (path_pch / f"{_PCH_NAME}.gch").is_file():
+        return path_pch
+
+    path_pch.mkdir(parents=True, exist_ok=True)
+    with (path_pch / _PCH_NAME).open("w") as fio:
+        fio.write(code)
+
+    subprocess.check_call(
+        (
+            f"cd {path_pch} && "
+            f"g++ -std=c++17 -fpic {flags} "
+            f"-I {str(path_headers.absolute())} "
+            f"-x c++-header -o {_PCH_NAME}.gch {_PCH_NAME}"
+        ),
+        shell=True,
+    )
+
+    return path_pch
+
+
+def compile_wrapped(
+    class_name: str,
+    path_build: Path,
+    path_headers: Path,
+    code: str,
+    include_dirs: Iterable[Path] = (),
+    lib_name: str = None,
+    profile: str = "baseline",
+    extra_flags: Iterable[str] = (),
+    pch: bool = False,
+) -> float:
+    """
+    Copile warpped faust code into a dll. Headers in `include_dirs` take
+    precedence over those in `path_headers`. The library is named after the
+    class unless `lib_name` is given.
+
+    The optimization flags are those of the `profile` in `BUILD_PROFILES`,
+    followed by `extra_flags`. With `pch`, the headers common to all classes
+    are precompiled once (see `precompile_headers`) such that only the class
+    code is compiled.
+
+    Returns:
+        the duration of the compilation in seconds, excluding the
+        precompilation of the headers
+    """
     path_build.mkdir(parents=True, exist_ok=True)
+    lib_name = lib_name or class_name
+    flags = " ".join([BUILD_PROFILES[profile], *extra_flags])
+
+    include_dirs = list(include_dirs)
+    if pch:
+        include_dirs.insert(0, precompile_headers(path_build, path_headers, flags))
+        # the precompiled header is only used if it is the first include
+        code = f'#include "{_PCH_NAME}"\n' + code
+        flags += " -Winvalid-pch"
 
-    path_cpp = path_build / f"{class_name}.cpp"
+    path_cpp = path_build / f"{lib_name}.cpp"
     with path_cpp.open("w") as fio:
         fio.write(code)
 
+    includes = [*include_dirs, path_headers]
+    includes = " ".join([f"-I {str(p.absolute())}" for p in includes])
+
+    start = time.perf_counter()
     subprocess.check_call(
         (
             f"cd {path_build} && "
-            "g++ -std=c++17 -shared -fpic -O3 "
-            f"-I {str(path_headers.absolute())} "
-            f"-o {class_name}.so "
-            f"{class_name}.cpp"
+            f"g++ -std=c++17 -shared -fpic {flags} "
+            f"{includes} "
+            f"-o {lib_name}.so "
+            f"{lib_name}.cpp"
         ),
         shell=True,
     )
 
+    return time.perf_counter() - start
+
+
+def _train_pgo(
+    lib_name: str, path: Path, signals: List[Path], values: Mapping[str, float]
+):
+    """Render the signals through an instrumented library."""
+    from .utils import wave_to_numpy
+
+    func = make_callable(lib_name, path)
+    for path_signal in signals:
+        signal, fs = wave_to_numpy(str(path_signal))
+        func(fs, signal, **values)
+
 
-def make_callable(class_name: str, path: Path, parameters: Iterable[str]):
-    """Create a function which will call the fasut dsp from a library."""
-    cdll = ctypes.cdll.LoadLibrary(str(path / f"{class_name}.so"))
-    c_compute = cdll.compute
+def compile_pgo(
+    class_name: str,
+    path_build: Path,
+    path_headers: Path,
+    code: str,
+    train_signals: Iterable[Path],
+    train_values: Mapping[str, float],
+    include_dirs: Iterable[Path] = (),
+    lib_name: str = None,
+):
+    """
+    Compile wrapped faust code with profile guided optimization.
+
+    An instrumented library is built and `train_signals` (wave files) are
+    rendered through it with the parameters `train_values`, then the library
+    is rebuilt using the recorded profile. The training runs in a separate
+    process so that the profile is written when it exits, and so that the
+    instrumented library is never loaded in this process.
+    """
+    lib_name = lib_name or class_name
+    # the profile is keyed on the output path, both builds must share it
+    path_profile = (path_build / "pgo" / lib_name).absolute()
+    shutil.rmtree(path_profile, ignore_errors=True)
+
+    compile_wrapped(
+        class_name,
+        path_build,
+        path_headers,
+        code,
+        include_dirs=include_dirs,
+        lib_name=lib_name,
+        profile="pgo",
+        extra_flags=[f"-fprofile-generate={path_profile}"],
+    )
+
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(
+        target=_train_pgo,
+        args=(lib_name, path_build, list(train_signals), dict(train_values)),
+    )
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"PGO training of {lib_name} failed")
+
+    compile_wrapped(
+        class_name,
+        path_build,
+        path_headers,
+        code,
+        include_dirs=include_dirs,
+        lib_name=lib_name,
+        profile="pgo",
+        extra_flags=[
+            f"-fprofile-use={path_profile}",
+            "-fprofile-correction",
+            "-Wmissing-profile",
+        ],
+    )
 
-    def py_callable(fs: int, buffer: np.ndarray, **kwargs):
-        buffer = np.copy(buffer, order="C").astype("float32")
-        if len(buffer.shape) == 1:
-            buffer = np.ascontiguousarray(buffer[None, :])
-        assert len(buffer.shape) == 2
 
-        c_samplingFreq = ctypes.c_int(fs)
-        c_count = ctypes.c_int(buffer.shape[1])
+class DspLibrary:
+    """
+    A compiled dsp library. The parameter names and their order are read from
+    the library's parameter table, and parameter values are passed to the
+    library as a single float32 array.
+    """
 
-        c_buffer = (ctypes.POINTER(ctypes.c_float) * 2)()
-        for i in range(buffer.shape[0]):
-            c_buffer[i] = buffer[i].ctypes.data_as(ctypes.POINTER(ctypes.c_float))
+    def __init__(self, lib_name: str, path: Path):
+        self.lib_name = lib_name
+        self.cdll = ctypes.cdll.LoadLibrary(str(path / f"{lib_name}.so"))
 
-        args = [ctypes.c_float(kwargs[n]) for n in parameters]
+        self.cdll.num_params.restype = ctypes.c_int
+        self.cdll.param_name.restype = ctypes.c_char_p
+        self.cdll.param_name.argtypes = [ctypes.c_int]
+        self.cdll.create.restype = ctypes.c_void_p
+        self.cdll.create.argtypes = [ctypes.c_int]
+        self.cdll.destroy.argtypes = [ctypes.c_void_p]
+        self.cdll.set_params.argtypes = [ctypes.c_void_p, _FLOAT_P, ctypes.c_int]
+        self.cdll.process.argtypes = [ctypes.c_void_p, ctypes.c_int, _BUFFER]
 
-        c_compute(
-            c_samplingFreq,
-            c_count,
-            ctypes.byref(c_buffer),
-            *args,
+        self.parameters = [
+            self.cdll.param_name(i).decode("utf8")
+            for i in range(self.cdll.num_params())
+        ]
+
+        # size of the dsp state in bytes, if the library can save it
+        self.state_size = None
+        if hasattr(self.cdll, "state_size"):
+            self.cdll.state_size.restype = ctypes.c_int
+            self.cdll.save_state.restype = ctypes.c_int
+            self.cdll.save_state.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+            self.cdll.load_state.restype = ctypes.c_int
+            self.cdll.load_state.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+            self.cdll.compute_from_state.restype = ctypes.c_int
+            self.cdll.compute_from_state.argtypes = [
+                ctypes.c_int,
+                ctypes.c_int,
+                _BUFFER,
+                _FLOAT_P,
+                ctypes.c_int,
+                ctypes.c_char_p,
+            ]
+            self.state_size = self.cdll.state_size()
+
+        # libraries wrapped before the denormal modes can't flush them
+        self.can_flush_denormals = hasattr(self.cdll, "set_flush_denormals")
+        if self.can_flush_denormals:
+            self.cdll.set_flush_denormals.argtypes = [ctypes.c_int]
+            self.cdll.get_flush_denormals.restype = ctypes.c_int
+
+    @property
+    def flush_denormals(self) -> bool:
+        """
+        Whether the library flushes denormals to zero while processing. The
+        flag is shared by all the callables and instances of the library, and
+        only applies to the threads while they are in a native call.
+        """
+        return self.can_flush_denormals and bool(self.cdll.get_flush_denormals())
+
+    @flush_denormals.setter
+    def flush_denormals(self, enabled: bool):
+        if not self.can_flush_denormals:
+            raise RuntimeError(f"{self.lib_name} built without denormal modes")
+        self.cdll.set_flush_denormals(int(enabled))
+
+    def pack(self, values: np.ndarray = None, **kwargs) -> np.ndarray:
+        """
+        Return the parameter values as an array in table order. If `values` is
+        given it is used directly, otherwise the values are gathered from
+        `kwargs`.
+        """
+        if values is None:
+            values = [kwargs[n] for n in self.parameters]
+        values = np.ascontiguousarray(values, dtype="float32")
+        if values.shape != (len(self.parameters),):
+            raise ValueError(
+                f"expected {len(self.parameters)} parameter values "
+                f"for {self.lib_name}, got shape {values.shape}"
+            )
+        return values
+
+    def steady_state(
+        self, fs: int, lead_in: np.ndarray, values: np.ndarray = None, **kwargs
+    ) -> bytes:
+        """
+        Run an instance through `lead_in` and return its state, such that
+        later renders can start from there instead of from silence.
+        """
+        instance = DspInstance(self, fs)
+        instance.set_params(values, **kwargs)
+        instance.process(_as_buffer(lead_in))
+        return instance.save_state()
+
+
+def _check_state_status(status: int, state: bytes, fs: int):
+    """Raise for the status returned by loading a state in the library."""
+    if status == -2:
+        saved_fs = int(np.frombuffer(state[: np.dtype("intc").itemsize], "intc")[0])
+        raise ValueError(f"state saved at {saved_fs} Hz can't be loaded at {fs} Hz")
+    if status != 0:
+        raise RuntimeError("faust instance wasn't found for this instance")
+
+
+class DspInstance:
+    """
+    A persistent dsp instance in a `DspLibrary`. Parameters can be changed
+    between calls to `process` and the dsp state carries over.
+    """
+
+    def __init__(self, library: DspLibrary, fs: int, state: bytes = None):
+        self.library = library
+        self.fs = fs
+        self.handle = library.cdll.create(fs)
+        if state is not None:
+            self.load_state(state)
+
+    def __del__(self):
+        if getattr(self, "handle", None):
+            self.library.cdll.destroy(self.handle)
+            self.handle = None
+
+    def set_params(self, values: np.ndarray = None, **kwargs):
+        values = self.library.pack(values, **kwargs)
+        self.library.cdll.set_params(
+            self.handle, values.ctypes.data_as(_FLOAT_P), values.shape[0]
         )
 
+    def process(self, buffer: np.ndarray) -> np.ndarray:
+        """Process a C contiguous float32 buffer in place and return it."""
+        assert buffer.dtype == np.float32 and buffer.flags["C_CONTIGUOUS"]
+        self.library.cdll.process(self.handle, buffer.shape[-1], _c_buffer(buffer))
+        return buffer
+
+    def save_state(self) -> bytes:
+        """
+        Serialize the dsp state (not the parameters) to bytes, along with the
+        sampling rate which it can only be loaded at.
+        """
+        if self.library.state_size is None:
+            raise RuntimeError(f"{self.library.lib_name} built without state")
+        state = ctypes.create_string_buffer(self.library.state_size)
+        if self.library.cdll.save_state(self.handle, state) != 0:
+            raise RuntimeError("faust instance wasn't found for this instance")
+        return state.raw
+
+    def load_state(self, state: bytes):
+        """Restore the dsp state saved by `save_state`."""
+        if self.library.state_size is None:
+            raise RuntimeError(f"{self.library.lib_name} built without state")
+        if len(state) != self.library.state_size:
+            raise ValueError(
+                f"expected a state of {self.library.state_size} bytes, "
+                f"got {len(state)}"
+            )
+        status = self.library.cdll.load_state(self.handle, state)
+        _check_state_status(status, state, self.fs)
+
+
+def _as_buffer(buffer: np.ndarray) -> np.ndarray:
+    """Copy a signal into a new (channels, samples) float32 buffer."""
+    buffer = np.copy(buffer, order="C").astype("float32")
+    if len(buffer.shape) == 1:
+        buffer = np.ascontiguousarray(buffer[None, :])
+    assert len(buffer.shape) == 2
+    return buffer
+
+
+def _c_buffer(buffer: np.ndarray):
+    """Array of channel pointers into a float32 buffer."""
+    if len(buffer.shape) == 1:
+        buffer = buffer[None, :]
+    c_buffer = _BUFFER()
+    for i in range(buffer.shape[0]):
+        c_buffer[i] = buffer[i].ctypes.data_as(_FLOAT_P)
+    return c_buffer
+
+
+def make_callable(lib_name: str, path: Path):
+    """
+    Create a function which will call the fasut dsp from a library.
+
+    The function takes the parameters either as keyword arguments or as a
+    `values` array in the order of `py_callable.parameters`. Passing an array
+    avoids gathering the parameters at every call.
+
+    If the library was built with state support, a `state` from
+    `DspLibrary.steady_state` can be given to start the render from it.
+    """
+    library = DspLibrary(lib_name, path)
+    c_compute = library.cdll.compute
+    c_compute.argtypes = [ctypes.c_int, ctypes.c_int, _BUFFER, _FLOAT_P, ctypes.c_int]
+
+    def py_callable(
+        fs: int,
+        buffer: np.ndarray,
+        values: np.ndarray = None,
+        state: bytes = None,
+        **kwargs,
+    ):
+        buffer = _as_buffer(buffer)
+        values = library.pack(values, **kwargs)
+
+        if state is None:
+            c_compute(
+                fs,
+                buffer.shape[1],
+                _c_buffer(buffer),
+                values.ctypes.data_as(_FLOAT_P),
+                values.shape[0],
+            )
+        else:
+            if len(state) != library.state_size:
+                raise ValueError(f"{lib_name} can't load a state of {len(state)} bytes")
+            status = library.cdll.compute_from_state(
+                fs,
+                buffer.shape[1],
+                _c_buffer(buffer),
+                values.ctypes.data_as(_FLOAT_P),
+                values.shape[0],
+                state,
+            )
+            _check_state_status(status, state, fs)
+
         return buffer
 
+    py_callable.parameters = library.parameters
+    py_callable.library = library
+
     return py_callable
 
 
-def build_fausthpp(
-    path_build: Path, path_headers: Path, path_dsp: Path, class_name: str
-):
+def automation_trajectories(
+    parameters: Iterable[str],
+    fs: int,
+    count: int,
+    block_size: int,
+    automation: Mapping[str, Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]],
+    values: Mapping[str, float],
+) -> np.ndarray:
+    """
+    Build the parameter trajectories for `make_automated_callable`.
+
+    Args:
+        parameters: the parameters in library order
+        fs: sampling rate
+        count: number of samples to process
+        block_size: number of samples between parameter updates
+        automation: for each automated parameter, either an array of `count`
+            values (one per sample) or a tuple of breakpoint times (seconds)
+            and values which are linearly interpolated, a step is made with
+            two breakpoints at the same time
+        values: the value of the parameters which aren't automated
+
+    Returns:
+        array of shape (blocks, parameters) with the values at the start of
+        each block
+    """
+    if block_size <= 0:
+        raise ValueError(f"block_size must be positive, not {block_size}")
+
+    parameters = list(parameters)
+    starts = np.arange(0, count, block_size)
+
+    trajectories = np.zeros((len(starts), len(parameters)), dtype="float32")
+    for ipar, par in enumerate(parameters):
+        if par not in automation:
+            trajectories[:, ipar] = values[par]
+            continue
+        trajectory = automation[par]
+        if isinstance(trajectory, tuple):
+            times, points = trajectory
+            trajectories[:, ipar] = np.interp(starts / fs, times, points)
+        else:
+            trajectory = np.asarray(trajectory)
+            if trajectory.shape != (count,):
+                raise ValueError(f"trajectory for {par} must have {count} values")
+            trajectories[:, ipar] = trajectory[starts]
+
+    unknown = set(automation) - set(parameters)
+    if unknown:
+        raise ValueError(f"unknown automated parameters: {sorted(unknown)}")
+
+    return trajectories
+
+
+def make_automated_callable(lib_name: str, path: Path):
+    """
+    Create a function which will call the faust dsp with parameters changing
+    over time. The parameters are updated at the start of every block of
+    `block_size` samples in native code, see `automation_trajectories`.
+    """
+    library = DspLibrary(lib_name, path)
+    c_compute_automated = library.cdll.compute_automated
+    c_compute_automated.argtypes = [
+        ctypes.c_int,
+        ctypes.c_int,
+        _BUFFER,
+        _FLOAT_P,
+        ctypes.c_int,
+        ctypes.c_int,
+    ]
+
+    def py_automated(
+        fs: int, buffer: np.ndarray, trajectories: np.ndarray, block_size: int
+    ):
+        if block_size <= 0:
+            raise ValueError(f"block_size must be positive, not {block_size}")
+        buffer = _as_buffer(buffer)
+
+        num_blocks = -(-buffer.shape[1] // block_size)
+        trajectories = np.ascontiguousarray(trajectories, dtype="float32")
+        if trajectories.shape != (num_blocks, len(library.parameters)):
+            raise ValueError(
+                f"expected trajectories of shape "
+                f"{(num_blocks, len(library.parameters))}, "
+                f"got {trajectories.shape}"
+            )
+
+        c_compute_automated(
+            fs,
+            buffer.shape[1],
+            _c_buffer(buffer),
+            trajectories.ctypes.data_as(_FLOAT_P),
+            trajectories.shape[1],
+            block_size,
+        )
+
+        return buffer
+
+    py_automated.parameters = library.parameters
+    py_automated.library = library
+
+    return py_automated
+
+
+def make_level_callable(lib_name: str, path: Path, block_size: int = 4096):
+    """
+    Create a function which measures the standard deviation of the faust dsp
+    output. The signal is processed in blocks of `block_size` samples and only
+    running sums are kept, so the output is never materialized.
+    """
+    if block_size <= 0:
+        raise ValueError(f"block_size must be positive, not {block_size}")
+
+    library = DspLibrary(lib_name, path)
+    c_compute_level = library.cdll.compute_level
+    c_compute_level.argtypes = [
+        ctypes.c_int,
+        ctypes.c_int,
+        _FLOAT_P,
+        ctypes.c_int,
+        ctypes.POINTER(ctypes.c_double),
+        _FLOAT_P,
+        ctypes.c_int,
+    ]
+
+    def py_level(
+        fs: int, signal: np.ndarray, values: np.ndarray = None, **kwargs
+    ) -> float:
+        signal = np.ascontiguousarray(signal, dtype="float32")
+        assert len(signal.shape) == 1
+        values = library.pack(values, **kwargs)
+
+        moments = np.zeros(2, dtype="float64")
+
+        c_compute_level(
+            fs,
+            signal.shape[0],
+            signal.ctypes.data_as(_FLOAT_P),
+            block_size,
+            moments.ctypes.data_as(ctypes.POINTER(ctypes.c_double)),
+            values.ctypes.data_as(_FLOAT_P),
+            values.shape[0],
+        )
+
+        mean = moments[0] / signal.shape[0]
+        return float(np.sqrt(max(0.0, moments[1] / signal.shape[0] - mean ** 2)))
+
+    py_level.parameters = library.parameters
+    py_level.library = library
+
+    return py_level
+
+
+def make_monitor_callable(lib_name: str, path: Path, num_taps: int):
+    """
+    Create a function which will call the monitored faust dsp from a library.
+    The returned buffer has the `num_taps` tap channels appended after the
+    output channels.
+    """
+    library = DspLibrary(lib_name, path)
+    c_compute_monitor = library.cdll.compute_monitor
+
+    def py_monitor(fs: int, buffer: np.ndarray, values: np.ndarray = None, **kwargs):
+        buffer = _as_buffer(buffer)
+        values = library.pack(values, **kwargs)
+
+        taps = np.zeros((num_taps, buffer.shape[1]), dtype="float32")
+
+        c_taps = (_FLOAT_P * max(1, num_taps))()
+        for i in range(num_taps):
+            c_taps[i] = taps[i].ctypes.data_as(_FLOAT_P)
+
+        c_compute_monitor(
+            ctypes.c_int(fs),
+            ctypes.c_int(buffer.shape[1]),
+            _c_buffer(buffer),
+            c_taps,
+            values.ctypes.data_as(_FLOAT_P),
+            ctypes.c_int(values.shape[0]),
+        )
+
+        return np.concatenate((buffer, taps), axis=0)
+
+    py_monitor.parameters = library.parameters
+    py_monitor.library = library
+
+    return py_monitor
+
+
+def run_fausthpp(path_headers: Path, path_dsp: Path, class_name: str) -> List[str]:
+    """Generate the headers for a faust class and return its parameters."""
     compiled_pars = subprocess.check_output(
         [
             "faust2hpp",
@@ -141,64 +1164,385 @@ def build_fausthpp(
         encoding="utf8",
     )
 
-    compiled_pars = [c.strip() for c in compiled_pars.split("\n") if c.strip()]
+    return [c.strip() for c in compiled_pars.split("\n") if c.strip()]
 
-    with (path_headers / f"{class_name}.h").open("r") as fio:
+
+def faust_codegen(
+    path_headers: Path, path_dsp: Path, class_name: str, options: Iterable[str]
+) -> str:
+    """
+    Generate the faust class code with the given faust compiler options (see
+    `CODEGEN_MODES`) and splice it into the header generated by faust2hpp in
+    place of the default scalar code. The options follow those which
+    faust2hpp used, as recorded in its header.
+
+    Only the faust class and the code emitted with it are replaced, such that
+    anything faust2hpp places around it is kept. Note that the compute loop of
+    vectorized code can't be monitored with `monitor_faust_code`.
+
+    Returns:
+        the code of the faust header
+    """
+    with (path_headers / f"{class_name}Faust.h").open("r") as fio:
         code = fio.read()
 
-    wrapped_code = wrap_compute(code, class_name, compiled_pars)
-    compile_wrapped(class_name, path_build, path_headers, wrapped_code)
+    match = _FAUST_OPTIONS.search(code)
+    if match is None:
+        raise RuntimeError(f"can't find the faust options of {class_name}Faust")
+    base_options = list()
+    tokens = iter(match.group(1).split())
+    for token in tokens:
+        if token in _FAUST_OWN_OPTIONS:
+            for _ in range(_FAUST_OWN_OPTIONS[token]):
+                next(tokens, None)
+        else:
+            base_options.append(token)
 
-    return make_callable(class_name, path_build, compiled_pars), compiled_pars
+    faust_code = subprocess.check_output(
+        [
+            "faust",
+            "-lang",
+            "cpp",
+            "-cn",
+            f"{class_name}Faust",
+            "-I",
+            str(path_dsp),
+            *base_options,
+            *options,
+            str(path_dsp / f"{class_name}.dsp"),
+        ],
+        encoding="utf8",
+    )
 
+    def class_span(code: str) -> Tuple[int, int]:
+        match = re.search(rf"^class {class_name}Faust\b", code, flags=re.MULTILINE)
+        if match is None:
+            raise RuntimeError(f"can't find class {class_name}Faust in source")
+        # faust emits its code starting with the FAUSTFLOAT definition, the
+        # last one before the class in case an architecture defines it too
+        idx_start = code.rfind("#ifndef FAUSTFLOAT", 0, match.start())
+        idx_end = code.find("\n};", match.start())
+        if idx_start < 0 or idx_end < 0:
+            raise RuntimeError(f"can't find the code of {class_name}Faust")
+        return idx_start, idx_end
 
-def build_fausthpp_monitor(
+    idx_start, idx_end = class_span(code)
+    idx_faust_start, idx_faust_end = class_span(faust_code)
+
+    return "".join(
+        (
+            code[:idx_start],
+            faust_code[idx_faust_start:idx_faust_end],
+            code[idx_end:],
+        )
+    )
+
+
+def codegen_dir(path_build: Path, options: Iterable[str]) -> Path:
+    """
+    The directory of the faust headers generated with the given options by
+    `build_fausthpp`, named after the mode of `CODEGEN_MODES` if any.
+    """
+    options = list(options)
+    modes = [m for m, o in CODEGEN_MODES.items() if o == options]
+    name = modes[0] if modes else "_".join(o.lstrip("-") for o in options)
+    return path_build / "codegen" / name
+
+
+def build_fausthpp(
     path_build: Path,
     path_headers: Path,
     path_dsp: Path,
     class_name: str,
-    monitor_member: str,
+    state: bool = False,
+    faust_options: Iterable[str] = (),
+    pch: bool = False,
+    compare_pch: bool = False,
 ):
-    compiled_pars = subprocess.check_output(
-        [
-            "faust2hpp",
-            str(path_headers),
-            str(path_dsp / f"{class_name}.dsp"),
-            class_name,
-            "--pars_file",
-            str(path_dsp / f"{class_name}.json"),
-            "--print_pars",
-        ],
-        encoding="utf8",
-    )
-    compiled_pars = [c.strip() for c in compiled_pars.split("\n") if c.strip()]
+    """
+    Generate the headers for a faust class and build its library. With
+    `state`, the library is built from a copy of the faust code patched with
+    `state_faust_code` so that instances can be saved and restored.
+
+    The faust class is generated with the faust compiler options
+    `faust_options`, if any (see `faust_codegen`), into the directory given by
+    `codegen_dir` which takes precedence over `path_headers`. With `pch` the
+    common headers are precompiled (see `compile_wrapped`), and with
+    `compare_pch` the class is also compiled without them, to a separate
+    library, to time both.
+
+    Returns:
+        the dsp function, the parameters of the class and the compilation
+        time (s) by "pch" or "nopch"
+    """
+    compiled_pars = run_fausthpp(path_headers, path_dsp, class_name)
 
     with (path_headers / f"{class_name}Faust.h").open("r") as fio:
         code = fio.read()
+    with (path_headers / f"{class_name}.h").open("r") as fio:
+        wrapper_code = fio.read()
 
-    if code.find(monitor_member) < 0:
-        raise RuntimeError(f"{monitor_member} not found in source")
+    include_dirs = list()
+    faust_options = list(faust_options)
+    if faust_options:
+        code = faust_codegen(path_headers, path_dsp, class_name, faust_options)
+        path_codegen = codegen_dir(path_build, faust_options)
+        _write_patched(path_codegen, path_headers, class_name, code)
+        include_dirs.append(path_codegen)
 
-    idx_insert = code.find("\tvirtual void compute(")
-    idx_insert = code.find("\t\t}\n\t}\n", idx_insert)
-    if idx_insert < 0:
-        raise RuntimeError("can't find inspection insertion point")
+    if state:
+        path_state = path_build / "state"
+        # patched headers of previous builds mustn't shadow those of this one
+        shutil.rmtree(path_state, ignore_errors=True)
+        code = state_faust_code(code, class_name)
+        wrapper_code = state_wrapper_code(wrapper_code, class_name)
+        _write_patched(path_state, path_headers, class_name, code, wrapper_code)
+        include_dirs.insert(0, path_state)
 
-    code = "".join(
-        (
-            code[:idx_insert],
-            f"\t\t\toutputs[0][i] = {monitor_member}[0];\n",
-            code[idx_insert:],
+    wrapped_code = wrap_compute(wrapper_code, class_name, compiled_pars, state=state)
+    seconds = dict()
+    if pch and compare_pch:
+        seconds["nopch"] = compile_wrapped(
+            class_name,
+            path_build,
+            path_headers,
+            wrapped_code,
+            include_dirs=include_dirs,
+            lib_name=f"{class_name}-nopch",
         )
+    seconds["pch" if pch else "nopch"] = compile_wrapped(
+        class_name,
+        path_build,
+        path_headers,
+        wrapped_code,
+        include_dirs=include_dirs,
+        pch=pch,
     )
 
-    with (path_headers / f"{class_name}Faust.h").open("w") as fio:
-        fio.write(code)
+    return make_callable(class_name, path_build), compiled_pars, seconds
+
+
+def build_monitor(
+    path_build: Path,
+    path_headers: Path,
+    class_name: str,
+    parameters: Iterable[str],
+    monitor_members: Mapping[str, Iterable[str]],
+):
+    """
+    Build `class_name` such that the members of the faust classes it uses are
+    routed to extra output channels.
+
+    The patched faust headers, along with copies of their wrappers, are
+    written to `path_build / "monitor"` which takes precedence over
+    `path_headers` when compiling. The headers in `path_headers` are left
+    untouched. This works for the faust2hpp classes as well as for classes
+    composed from them such as `PushPullAmp`, as long as each monitored class
+    is processed in a single call per buffer.
+
+    Args:
+        path_build: directory in which to build
+        path_headers: directory containing the generated headers
+        class_name: the top level class to build
+        parameters: parameters of the top level class
+        monitor_members: for each faust class, the list of members to tap (see
+            `monitor_faust_code`), taps are returned in this order
+
+    Returns:
+        the monitor callable (see `make_monitor_callable`)
+    """
+    path_monitor = path_build / "monitor"
+    # patched headers of previous builds mustn't shadow those of this one
+    shutil.rmtree(path_monitor, ignore_errors=True)
+
+    monitors = dict()
+    for monitor_class, members in monitor_members.items():
+        members = list(members)
+        with (path_headers / f"{monitor_class}Faust.h").open("r") as fio:
+            code = fio.read()
+        code = monitor_faust_code(code, monitor_class, members)
+        _write_patched(path_monitor, path_headers, monitor_class, code)
+        monitors[monitor_class] = len(members)
 
     with (path_headers / f"{class_name}.h").open("r") as fio:
         code = fio.read()
 
-    wrapped_code = wrap_compute(code, class_name, compiled_pars)
-    compile_wrapped(class_name, path_build, path_headers, wrapped_code)
+    # use a distinct library so it doesn't alias an already loaded build
+    lib_name = f"{class_name}Monitor"
+    wrapped_code = wrap_compute(code, class_name, parameters, monitors)
+    compile_wrapped(
+        class_name,
+        path_build,
+        path_headers,
+        wrapped_code,
+        include_dirs=[path_monitor],
+        lib_name=lib_name,
+    )
+
+    return make_monitor_callable(lib_name, path_build, sum(monitors.values()))
+
+
+def build_fausthpp_monitor(
+    path_build: Path,
+    path_headers: Path,
+    path_dsp: Path,
+    class_name: str,
+    monitor_members: Union[str, Iterable[str]],
+):
+    """
+    Build a faust class with the given members routed to extra output
+    channels, see `build_monitor`.
+    """
+    if isinstance(monitor_members, str):
+        monitor_members = [monitor_members]
+
+    compiled_pars = run_fausthpp(path_headers, path_dsp, class_name)
+
+    func = build_monitor(
+        path_build,
+        path_headers,
+        class_name,
+        compiled_pars,
+        {class_name: monitor_members},
+    )
+
+    return func, compiled_pars
+
+
+# parameters of a typical configuration of the `PushPullAmp`, which is
+# compiled with the parameters it is given
+PUSH_PULL_PARS = {
+    "triode_num_stages": 3,
+    "triode_overhead": 0,
+    "triode_hp_freq": 0,
+    "triode_grid_tau": 0,
+    "triode_grid_ratio": 0,
+    "triode_grid_level": 0,
+    "triode_grid_clip": 0,
+    "triode_plate_bias": 0,
+    "triode_plate_comp_ratio": 0,
+    "triode_plate_comp_level": 0,
+    "triode_plate_comp_offset": 0,
+    "triode_drive": 0,
+    "tetrode_hp_freq": 0,
+    "tetrode_grid_tau": 0,
+    "tetrode_grid_ratio": 0,
+    "tetrode_plate_comp_depth": 0,
+    "tetrode_plate_sag_tau": 0,
+    # sag will result in significant loudness fluctuations over time
+    "tetrode_plate_sag_toggle": -1,
+    "tetrode_plate_sag_depth": 0,
+    "tetrode_plate_sag_ratio": 0,
+    "tetrode_plate_sag_factor": 0,
+    "tetrode_drive": 0,
+    "tonestack_bass": 0,
+    "tonestack_mids": 0,
+    "tonestack_treble": 0,
+    "tonestack_selection": 0,
+    "cabinet_brightness": 0,
+    "cabinet_distance": 0,
+    "cabinet_dynamic": 0,
+    "input_level": 0,
+    "output_level": 0,
+}
+
+
+def default_values(class_name: str, parameters: Iterable[str]) -> Dict[str, float]:
+    """
+    Parameter values which render a class with its JSON defaults. The triode
+    has parameters controlled by the `PushPullAmp` which don't default at zero.
+    """
+    values = {p: 0.0 for p in parameters}
+    if class_name == "Triode":
+        values["mix"] = 1.0
+        values["overhead"] = 1.0
+        values["unscale"] = 1.0
+    return values
+
+
+def chain_stage_names(class_names: Iterable[str]) -> List[str]:
+    """
+    Name the stages of a chain after their class, numbering the classes which
+    appear more than once (e.g. `triode0`, `triode1`, `cabinet`).
+    """
+    class_names = list(class_names)
+    names = list()
+    for iclass, class_name in enumerate(class_names):
+        name = class_name.lower()
+        if class_names.count(class_name) > 1:
+            name += str(class_names[:iclass].count(class_name))
+        names.append(name)
+    return names
+
+
+def chain_code(
+    chain_name: str,
+    class_names: Iterable[str],
+    class_pars: Mapping[str, Iterable[str]],
+    block_size: int,
+) -> Tuple[str, List[str]]:
+    """
+    Generate a class which processes a signal through the faust2hpp classes
+    `class_names` in order.
+
+    The signal is processed in blocks of `block_size` samples which go through
+    every stage in place, so no full length intermediate signal is stored.
+    The parameters of a stage are prefixed with the stage name (see
+    `chain_stage_names`), e.g. `triode0_hp_freq`.
+
+    Returns:
+        the code of the chain class and the list of its parameters
+    """
+    class_names = list(class_names)
+    stage_names = chain_stage_names(class_names)
+
+    parameters = list()
+    setters = list()
+    for stage, class_name in zip(stage_names, class_names):
+        for par in class_pars[class_name]:
+            parameters.append(f"{stage}_{par}")
+            setters.append(
+                f"void set_{stage}_{par}(FAUSTFLOAT value) "
+                f"{{ {stage}.set_{par}(value); }}"
+            )
+
+    code = _CHAIN_CODE.format(
+        name=chain_name,
+        includes="\n".join([f'#include "{c}.h"' for c in dict.fromkeys(class_names)]),
+        prepare="\n    ".join([f"{s}.prepare(sampleRate);" for s in stage_names]),
+        process="\n      ".join([f"{s}.process(size, block);" for s in stage_names]),
+        setters="\n  ".join(setters),
+        block_size=block_size,
+        members="\n  ".join([f"{c} {s};" for s, c in zip(stage_names, class_names)]),
+    )
+
+    return code, parameters
+
+
+def build_chain(
+    path_build: Path,
+    path_headers: Path,
+    path_dsp: Path,
+    class_names: Iterable[str],
+    chain_name: str = "Chain",
+    block_size: int = 256,
+):
+    """
+    Build a library which processes a signal through the faust2hpp classes
+    `class_names` in a single native call, see `chain_code`. A class can
+    appear any number of times, e.g. for several triode stages.
+
+    Returns:
+        the callable and the list of the chain parameters
+    """
+    class_names = list(class_names)
+    class_pars = {
+        c: run_fausthpp(path_headers, path_dsp, c) for c in dict.fromkeys(class_names)
+    }
+
+    code, parameters = chain_code(chain_name, class_names, class_pars, block_size)
+
+    wrapped_code = wrap_compute(code, chain_name, parameters)
+    compile_wrapped(chain_name, path_build, path_headers, wrapped_code)
 
-    return make_callable(class_name, path_build, compiled_pars), compiled_pars
+    return make_callable(chain_name, path_build), parameters
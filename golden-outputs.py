@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Record the outputs of the classes and the `PushPullAmp` over `data/*.wav` as
+golden references, or compare a build against them.
+
+Run `python build-all.py dsp/` first, such that the headers and class
+libraries exist.
+"""
+
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+from dspfit import golden, wrapdsp
+
+CLASS_NAMES = ("Cabinet", "ToneStack", "Triode", "TetrodeGrid", "TetrodePlate")
+
+
+def amp_build(path_build: Path, lib_suffix: str) -> Tuple[str, List[Path]]:
+    """
+    The build profile and the directories of the faust code of the class
+    libraries named with `lib_suffix`, as built by `build-all.py` (no suffix)
+    or `benchmark.py`, such that the `PushPullAmp` is built the same way.
+    """
+    name = lib_suffix[1:]
+    if not lib_suffix:
+        path_codegen = path_build / "codegen"
+        if not path_codegen.is_dir():
+            return "baseline", []
+        return "baseline", sorted(path_codegen.iterdir())
+    if name in ("pch", "nopch"):
+        return "baseline", []
+    if name in wrapdsp.BUILD_PROFILES and name != "pgo":
+        return name, []
+    if name in wrapdsp.CODEGEN_MODES:
+        options = wrapdsp.CODEGEN_MODES[name]
+        return "baseline", [wrapdsp.codegen_dir(path_build, options)]
+    raise ValueError(f"can't build the PushPullAmp like the {lib_suffix} libraries")
+
+
+def load_funcs(path_build: Path, path_headers: Path, lib_suffix: str) -> dict:
+    """
+    The dsp function and default parameters of each class built in
+    `path_build`, whose libraries are named after the class and
+    `lib_suffix`. The `PushPullAmp` is built with `wrapdsp.PUSH_PULL_PARS`
+    if its header is found, with the profile and the faust code of the class
+    libraries (see `amp_build`).
+    """
+    funcs = dict()
+    for class_name in CLASS_NAMES:
+        func = wrapdsp.make_callable(f"{class_name}{lib_suffix}", path_build)
+        funcs[class_name] = (func, wrapdsp.default_values(class_name, func.parameters))
+
+    path_amp = path_headers / "PushPullAmp.h"
+    if not path_amp.is_file():
+        print(f"skipping PushPullAmp, {path_amp} not found")
+        return funcs
+
+    profile, codegen_dirs = amp_build(path_build, lib_suffix)
+
+    # the amp header, and the class headers it includes relative to itself,
+    # are copied next to the generated code of the classes
+    path_include = path_build / "amp"
+    shutil.rmtree(path_include, ignore_errors=True)
+    path_include.mkdir(parents=True)
+    for path_codegen in codegen_dirs:
+        for path in path_codegen.glob("*.h"):
+            shutil.copyfile(path, path_include / path.name)
+    shutil.copyfile(path_amp, path_include / path_amp.name)
+
+    with path_amp.open("r") as fio:
+        code = fio.read()
+    lib_name = f"PushPullAmp{lib_suffix}"
+    pars = wrapdsp.PUSH_PULL_PARS
+    wrapped = wrapdsp.wrap_compute(code, "PushPullAmp", pars.keys())
+    wrapdsp.compile_wrapped(
+        "PushPullAmp",
+        path_build,
+        path_headers,
+        wrapped,
+        include_dirs=[path_include],
+        lib_name=lib_name,
+        profile=profile,
+    )
+    funcs["PushPullAmp"] = (wrapdsp.make_callable(lib_name, path_build), pars)
+
+    return funcs
+
+
+def main(
+    command: str,
+    path_golden: str,
+    path_build: str,
+    lib_suffix: str,
+    tolerances: list,
+    num_workers: int,
+):
+    path_golden = Path(path_golden)
+    funcs = load_funcs(Path(path_build), Path("headers"), lib_suffix)
+    signals = golden.load_signals(sorted(Path("data").glob("*.wav")))
+
+    start = time.perf_counter()
+    references = golden.render_references(funcs, signals, num_workers)
+    seconds = time.perf_counter() - start
+
+    if command == "record":
+        golden.save(path_golden, references)
+        print(
+            f"recorded {len(funcs)} classes over {len(signals)} signals "
+            f"in {seconds:.2f} s to {path_golden}"
+        )
+        return
+
+    tolerances = {k: float(v) for k, v in (t.split("=", 1) for t in tolerances or ())}
+    unknown = set(tolerances) - set(golden.TOLERANCES)
+    if unknown:
+        raise ValueError(f"unknown metrics {sorted(unknown)}")
+
+    results = golden.compare(golden.load(path_golden), references, tolerances)
+    num_failed = 0
+    for class_name, by_signal in sorted(results.items()):
+        for signal_name, result in sorted(by_signal.items()):
+            num_failed += not result["passed"]
+            if result["missing"]:
+                print(
+                    f"{class_name:>12s} {signal_name:>10s} {'FAILED':>9s} "
+                    f"missing from the {result['missing']}"
+                )
+                continue
+            status = (
+                "identical"
+                if result["identical"]
+                else ("passed" if result["passed"] else "FAILED")
+            )
+            print(
+                f"{class_name:>12s} {signal_name:>10s} {status:>9s} "
+                f"signal {result['signal_rel']:.2e} "
+                f"blocks {result['block_level_db']:.2e} dB "
+                f"spectrum {result['spectrum_db']:.2e} dB "
+                f"rms {result['rms_rel']:.2e} "
+                f"peak {result['peak_rel']:.2e}"
+            )
+    print(f"compared in {seconds:.2f} s, {num_failed} failed")
+
+    if num_failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "command",
+        choices=["record", "compare"],
+        help="record the golden references, or compare the build with them",
+    )
+    parser.add_argument("--path_golden", type=str, default="golden")
+    parser.add_argument(
+        "--path_build",
+        type=str,
+        default="build",
+        help="directory of the class libraries, e.g. build/benchmark",
+    )
+    parser.add_argument(
+        "--lib_suffix",
+        type=str,
+        default="",
+        help="suffix of the library names, e.g. -fastmath for a benchmark build",
+    )
+    parser.add_argument(
+        "--tolerances",
+        type=str,
+        nargs="+",
+        metavar="METRIC=VALUE",
+        help=f"override the tolerances of {', '.join(golden.TOLERANCES)}",
+    )
+    parser.add_argument("--num_workers", type=int, default=None)
+    args = parser.parse_args()
+    main(**vars(args))
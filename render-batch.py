@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Render a directory of wave files through `PushPullAmp` or a single class.
+
+Run `python build-all.py dsp/` first, such that the headers and class
+libraries exist.
+"""
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Tuple
+
+from dspfit import render, wrapdsp
+
+
+def load_library(
+    class_name: str, preset: dict, path_build: Path, path_headers: Path
+) -> Tuple[wrapdsp.DspLibrary, dict]:
+    """
+    Load the library of a class and the parameter values of a preset. The
+    `PushPullAmp` is compiled with the preset parameters, which must all be
+    given, the other classes default to their JSON values.
+    """
+    if class_name == "PushPullAmp":
+        with (path_headers / "PushPullAmp.h").open("r") as fio:
+            code = fio.read()
+        wrapped = wrapdsp.wrap_compute(code, "PushPullAmp", preset.keys())
+        wrapdsp.compile_wrapped("PushPullAmp", path_build, path_headers, wrapped)
+        return wrapdsp.DspLibrary("PushPullAmp", path_build), dict(preset)
+
+    library = wrapdsp.DspLibrary(class_name, path_build)
+    unknown = set(preset) - set(library.parameters)
+    if unknown:
+        raise ValueError(f"{class_name} has no parameters {sorted(unknown)}")
+    values = wrapdsp.default_values(class_name, library.parameters)
+    values.update(preset)
+    return library, values
+
+
+def main(
+    path_in: str,
+    preset: str,
+    path_out: str,
+    class_name: str,
+    block_size: int,
+    num_workers: int,
+):
+    path_in = Path(path_in)
+    path_out = Path(path_out)
+    path_out.mkdir(parents=True, exist_ok=True)
+
+    with Path(preset).open("r") as fio:
+        preset = json.load(fio)
+
+    library, kwargs = load_library(class_name, preset, Path("build"), Path("headers"))
+    values = library.pack(**kwargs)
+
+    paths = sorted(path_in.glob("*.wav"))
+
+    def process(path: Path) -> Tuple[float, float]:
+        duration, seconds = render.render_file(
+            library, values, path, path_out / path.name, block_size
+        )
+        print(
+            f"{path.name}: {duration:.1f} s in {seconds:.2f} s, "
+            f"x{duration / seconds:.1f} real time"
+        )
+        return duration, seconds
+
+    # the native calls release the GIL, each file has its own instance
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        results = list(pool.map(process, paths))
+    wall = time.perf_counter() - start
+
+    duration = sum(r[0] for r in results)
+    seconds = sum(r[1] for r in results)
+    print(
+        f"rendered {len(paths)} files, {duration:.1f} s of audio in {wall:.2f} s, "
+        f"x{duration / max(wall, 1e-9):.1f} real time overall, "
+        f"x{duration / max(seconds, 1e-9):.1f} per worker"
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path_in", type=str, help="directory of wave files")
+    parser.add_argument(
+        "preset", type=str, help="JSON file with the parameter values by name"
+    )
+    parser.add_argument("path_out", type=str, help="directory of rendered files")
+    parser.add_argument(
+        "--class_name",
+        type=str,
+        default="PushPullAmp",
+        choices=[
+            "PushPullAmp",
+            "Cabinet",
+            "ToneStack",
+            "Triode",
+            "TetrodeGrid",
+            "TetrodePlate",
+        ],
+    )
+    parser.add_argument(
+        "--block_size",
+        type=int,
+        default=1 << 16,
+        help="number of samples read, processed and written at a time",
+    )
+    parser.add_argument("--num_workers", type=int, default=None)
+    args = parser.parse_args()
+    main(**vars(args))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+#  Swanky Amp tube amplifier simulation
+#  Copyright (C) 2020  Garrin McGoldrick
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the frequency responses of a DSP class over a grid of knob values.
+
+Run `python build-all.py dsp/` first, such that the class library exists.
+"""
+
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+from dspfit import sweep, wrapdsp
+
+
+def main(
+    class_name: str,
+    knob: List[Tuple[str, str, str, str]],
+    output: str,
+    fs: int,
+    duration: float,
+    ir_length: int,
+    amplitude: float,
+    num_workers: int,
+):
+    func = wrapdsp.make_callable(class_name, Path("build"))
+    defaults = wrapdsp.default_values(class_name, func.parameters)
+
+    axes = {
+        name: np.linspace(float(start), float(stop), int(num))
+        for name, start, stop, num in knob
+    }
+
+    start = time.perf_counter()
+    responses = sweep.measure_grid(
+        func,
+        fs,
+        axes,
+        defaults,
+        duration=duration,
+        ir_length=ir_length,
+        amplitude=amplitude,
+        num_workers=num_workers,
+    )
+    num_points = int(np.prod([len(v) for v in axes.values()]))
+    print(
+        f"measured {num_points} responses of {class_name} "
+        f"in {time.perf_counter() - start:.2f} s"
+    )
+
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    responses.save(Path(output))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("class_name", type=str, choices=["ToneStack", "Cabinet"])
+    parser.add_argument(
+        "--knob",
+        type=str,
+        nargs=4,
+        action="append",
+        required=True,
+        metavar=("NAME", "START", "STOP", "NUM"),
+        help="grid axis of NUM values of the parameter NAME from START to STOP",
+    )
+    parser.add_argument("--output", type=str, required=True)
+    parser.add_argument("--fs", type=int, default=int(48e3))
+    parser.add_argument("--duration", type=float, default=2.0)
+    parser.add_argument(
+        "--ir_length",
+        type=int,
+        default=8192,
+        help="impulse response length, which sets the frequency resolution",
+    )
+    parser.add_argument(
+        "--amplitude",
+        type=float,
+        default=0.5,
+        help="sweep amplitude, the Cabinet dynamic term depends on the level",
+    )
+    parser.add_argument("--num_workers", type=int, default=None)
+    args = parser.parse_args()
+    main(**vars(args))